@@ -1,25 +1,70 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import numpy as np
 import io
 from datetime import datetime, timedelta
 import re
 import tempfile
 import os
+import shutil
 import glob
 from typing import Optional, List, Dict, Tuple
 import hashlib
 import time
 import signal
+import functools
+import importlib.util
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
-# Intentar importar Camelot
-try:
+# Camelot (y su cadena cv2/pdfminer) se importa bajo demanda: solo se paga al procesar un PDF
+def camelot_available() -> bool:
+    """Indica si Camelot está instalado sin llegar a importarlo"""
+    return importlib.util.find_spec('camelot') is not None
+
+
+@functools.lru_cache(maxsize=1)
+def _get_camelot():
+    """Importa Camelot la primera vez que se necesita y reutiliza el módulo"""
     import camelot
-    CAMELOT_AVAILABLE = True
-except ImportError:
-    CAMELOT_AVAILABLE = False
+    return camelot
+
+# Máximo de filas enviadas al navegador en las tablas principales
+MAX_PREVIEW_ROWS = 500
+
+# Opciones de xlsxwriter para los informes. No se usa constant_memory: pandas escribe
+# las celdas columna por columna y ese modo descarta las filas ya cerradas.
+XLSX_WRITER_KWARGS = {'options': {'strings_to_urls': False}}
+
+# Columnas de las que dependen las métricas clave de performance
+KPI_COLUMNS = ['Total_Open', 'Days_Since_Return', 'Priority_Level', 'Return_Date']
+
+# Pool para generar los informes Excel en segundo plano mientras se dibuja el dashboard
+_XLSX_POOL = ThreadPoolExecutor(max_workers=2)
+
+# Directorio para el PDF temporal: /dev/shm (tmpfs en Linux) si existe, así las lecturas
+# repetidas de Camelot sobre el mismo archivo no tocan el disco
+PDF_TMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+# Caché LRU de la extracción por página: (SHA-256 del PDF, página, configuración) -> (tablas, mensajes)
+PAGE_CACHE_SIZE = 16
+_PAGE_TABLES_CACHE = OrderedDict()
+_PAGE_TABLES_LOCK = threading.Lock()
+
+# Caché LRU de las extracciones correctas: SHA-256 del PDF -> DataFrame. Los fallos no se
+# guardan (se reintentan en la próxima subida) y la extracción dibuja su UI fuera de la caché
+PDF_CACHE_SIZE = 8
+_PDF_RESULTS_CACHE = OrderedDict()
+_PDF_RESULTS_LOCK = threading.Lock()
+
+# Ghostscript (backend de Lattice) admite una sola instancia por proceso: las lecturas
+# Lattice se serializan aunque las páginas se extraigan en paralelo
+_GHOSTSCRIPT_LOCK = threading.Lock()
+
+# Tipo de texto para las búsquedas masivas de la limpieza: cadenas Arrow (pyarrow llega
+# como dependencia de streamlit) y, si no estuviera, el object de siempre
+TEXT_SCAN_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') is not None else object
 
 # Configuración de página
 st.set_page_config(
@@ -30,7 +75,7 @@ st.set_page_config(
 )
 
 # CSS Profesional
-st.markdown("""
+APP_CSS = """
 <style>
     /* Evitar problemas de transparencia después de descargas */
     .stApp {
@@ -156,7 +201,23 @@ st.markdown("""
         border-left: 4px solid #2196f3;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def get_app_css() -> str:
+    """CSS de la app minificado una sola vez por proceso (sin comentarios ni espacios extra)"""
+    css = re.sub(r'/\*.*?\*/', '', APP_CSS, flags=re.DOTALL)
+    return re.sub(r'\s+', ' ', css).strip()
+
+def uppercase_codes(values: pd.Series) -> pd.Series:
+    """Pasar a mayúsculas un código repetitivo (WH_Code) operando solo sobre sus valores únicos"""
+    categorical = values.astype('category')
+    upper = categorical.cat.categories.str.upper()
+    
+    # Si dos códigos coinciden al pasar a mayúsculas (612d / 612D) no se pueden renombrar
+    if upper.is_unique and upper.notna().all():
+        return categorical.cat.rename_categories(upper)
+    return values.str.upper()
 
 class ExcelAnalyzer:
     """Analizador de múltiples archivos Excel para comparación"""
@@ -176,8 +237,8 @@ class ExcelAnalyzer:
         
         for file_path in file_paths:
             try:
-                # Leer Excel
-                df = pd.read_excel(file_path)
+                # Leer Excel (cacheado mientras el archivo no cambie en disco)
+                df = read_excel_cached(file_path, os.path.getmtime(file_path), os.path.getsize(file_path))
                 
                 # Extraer fecha del nombre del archivo o usar fecha de modificación
                 file_name = os.path.basename(file_path)
@@ -207,26 +268,33 @@ class ExcelAnalyzer:
         try:
             # Ordenar por fecha
             sorted_dates = sorted(excel_data.keys())
-            st.write(f"📊 Analizando fechas: {sorted_dates}")
             
             comparisons = []
+            prepared = {}  # Cada archivo se indexa y se resume una sola vez por análisis
             
-            for i in range(1, len(sorted_dates)):
-                current_date = sorted_dates[i]
-                previous_date = sorted_dates[i-1]
-                
-                current_df = excel_data[current_date]
-                previous_df = excel_data[previous_date]
+            # Progreso agrupado en un solo contenedor y escrito al final, no un mensaje por comparación
+            with st.status("🔄 Analizando archivos...", expanded=False) as status:
+                progress_lines = [f"📊 Analizando fechas: {sorted_dates}"]
                 
-                st.write(f"🔍 Comparando {previous_date} ({len(previous_df)} filas) vs {current_date} ({len(current_df)} filas)")
+                for i in range(1, len(sorted_dates)):
+                    current_date = sorted_dates[i]
+                    previous_date = sorted_dates[i-1]
+                    
+                    current_df = excel_data[current_date]
+                    previous_df = excel_data[previous_date]
+                    
+                    progress_lines.append(f"🔍 Comparando {previous_date} ({len(previous_df)} filas) vs {current_date} ({len(current_df)} filas)")
+                    
+                    comparison = self.compare_two_dataframes(
+                        current_df, previous_df, current_date, previous_date, prepared
+                    )
+                    comparisons.append(comparison)
                 
-                comparison = self.compare_two_dataframes(
-                    current_df, previous_df, current_date, previous_date
-                )
-                comparisons.append(comparison)
+                st.markdown('\n'.join(f"- {line}" for line in progress_lines))
+                status.update(label=f"✅ {len(comparisons)} comparaciones completadas", state='complete')
             
             # Resumen general
-            summary = self.create_comparison_summary(comparisons, excel_data)
+            summary = self.create_comparison_summary(comparisons, excel_data, prepared)
             
             return {
                 "comparisons": comparisons,
@@ -239,7 +307,8 @@ class ExcelAnalyzer:
             return {"error": f"Error en análisis: {str(e)}"}
     
     def compare_two_dataframes(self, current_df: pd.DataFrame, previous_df: pd.DataFrame, 
-                              current_date: str, previous_date: str) -> Dict:
+                              current_date: str, previous_date: str,
+                              prepared: Optional[Dict[str, Dict]] = None) -> Dict:
         """Comparar dos DataFrames específicos - VERSIÓN ROBUSTA"""
         
         try:
@@ -256,96 +325,96 @@ class ExcelAnalyzer:
                 st.warning(f"⚠️ {previous_date}: No se encontró columna Return_Packing_Slip")
                 return self._create_empty_comparison(current_date, previous_date)
             
-            # Albaranes actuales y anteriores
-            current_albaranes = set(current_df['Return_Packing_Slip'].astype(str))
-            previous_albaranes = set(previous_df['Return_Packing_Slip'].astype(str))
-            
-            # Calcular cambios
-            new_albaranes = current_albaranes - previous_albaranes
-            continuing_albaranes = current_albaranes.intersection(previous_albaranes)
+            # Una fila por albarán (la primera, como antes), indexada por el número como texto.
+            # El archivo de un día es el "actual" de una comparación y el "anterior" de la
+            # siguiente: se reutiliza su índice en lugar de volver a convertirlo a texto
+            if prepared is None:
+                prepared = {}
+            if current_date not in prepared:
+                prepared[current_date] = self._prepare_for_comparison(current_df)
+            if previous_date not in prepared:
+                prepared[previous_date] = self._prepare_for_comparison(previous_df)
+            current_idx = prepared[current_date]['slip_index']
+            previous_idx = prepared[previous_date]['slip_index']
+            
+            # Calcular cambios: posición de cada albarán actual en el archivo anterior (-1 = nuevo).
+            # Una sola pasada de hash separa nuevos y continuos y además los alinea
+            previous_pos = previous_idx.index.get_indexer(current_idx.index)
+            new_mask = previous_pos == -1
+            new_rows = current_idx[new_mask]
+            new_albaranes = new_rows.index
+            matched_pos = previous_pos[~new_mask]
+            continuing = current_idx[~new_mask].assign(**{
+                f'{col}_prev': previous_idx[col].to_numpy()[matched_pos]
+                for col in ('Total_Open', 'Total_Tablets', 'Tablets', 'Tablets_hash')
+            })
             
             # CORREGIDO: Albaranes cerrados son los que tienen Total_Open = 0 en el archivo actual
             # No los que desaparecen del archivo
-            closed_albaranes = set()
-            for albaran in current_albaranes:
-                albaran_row = current_df[current_df['Return_Packing_Slip'].astype(str) == albaran]
-                if not albaran_row.empty:
-                    total_open = pd.to_numeric(albaran_row.iloc[0].get('Total_Open', 0), errors='coerce') or 0
-                    if total_open == 0:
-                        closed_albaranes.add(albaran)
-            
-            # Análisis detallado de cambios en albaranes
-            closed_tablets = 0
-            added_tablets = 0
-            changed_albaranes = []
+            closed_albaranes = current_idx.index[current_idx['Total_Open'].to_numpy() == 0]
+            
+            # Análisis detallado de cambios en albaranes - diferencias vectorizadas
+            closed_delta = (continuing['Total_Open_prev'] - continuing['Total_Open']).clip(lower=0)
+            added_delta = (continuing['Total_Tablets'] - continuing['Total_Tablets_prev']).clip(lower=0)
+            empty_hash = pd.util.hash_array(np.array([''], dtype=object))[0]
+            list_changed = (
+                (continuing['Tablets_hash'] != continuing['Tablets_hash_prev']) &
+                (continuing['Tablets_hash'] != empty_hash) & (continuing['Tablets_hash_prev'] != empty_hash)
+            )
             
             # CORREGIDO: Contar tablillas de albaranes nuevos
-            for albaran in new_albaranes:
-                albaran_row = current_df[current_df['Return_Packing_Slip'].astype(str) == albaran]
-                if not albaran_row.empty:
-                    total_tablets = pd.to_numeric(albaran_row.iloc[0].get('Total_Tablets', 0), errors='coerce') or 0
-                    added_tablets += total_tablets
-                    
-                    # Agregar información del albarán nuevo
-                    change_info = {
-                        'albaran': albaran,
-                        'customer': albaran_row.iloc[0].get('Customer_Name', 'N/A'),
-                        'previous_open': 0,
-                        'current_open': pd.to_numeric(albaran_row.iloc[0].get('Total_Open', 0), errors='coerce') or 0,
-                        'previous_total': 0,
-                        'current_total': total_tablets,
-                        'changes': [f"🆕 Albarán nuevo con {total_tablets} tablillas"]
-                    }
-                    changed_albaranes.append(change_info)
-            
-            # Analizar cambios en albaranes que continúan
-            for albaran in continuing_albaranes:
-                current_row = current_df[current_df['Return_Packing_Slip'].astype(str) == albaran]
-                previous_row = previous_df[previous_df['Return_Packing_Slip'].astype(str) == albaran]
-                
-                if not current_row.empty and not previous_row.empty:
-                    # Datos actuales
-                    current_open = pd.to_numeric(current_row.iloc[0].get('Total_Open', 0), errors='coerce') or 0
-                    current_total = pd.to_numeric(current_row.iloc[0].get('Total_Tablets', 0), errors='coerce') or 0
-                    current_tablets_list = str(current_row.iloc[0].get('Tablets', ''))
-                    
-                    # Datos anteriores  
-                    previous_open = pd.to_numeric(previous_row.iloc[0].get('Total_Open', 0), errors='coerce') or 0
-                    previous_total = pd.to_numeric(previous_row.iloc[0].get('Total_Tablets', 0), errors='coerce') or 0
-                    previous_tablets_list = str(previous_row.iloc[0].get('Tablets', ''))
-                    
-                    # Análisis de cambios
-                    change_info = {
-                        'albaran': albaran,
-                        'customer': current_row.iloc[0].get('Customer_Name', 'N/A'),
-                        'previous_open': previous_open,
-                        'current_open': current_open,
-                        'previous_total': previous_total,
-                        'current_total': current_total,
-                        'changes': []
-                    }
-                    
-                    # 1. Detectar tablillas cerradas (reducción en Open)
-                    if previous_open > current_open:
-                        tablets_closed_count = previous_open - current_open
-                        closed_tablets += tablets_closed_count
-                        change_info['changes'].append(f"🔒 {tablets_closed_count} tablillas cerradas")
-                    
-                    # 2. Detectar tablillas agregadas (aumento en Total)
-                    if current_total > previous_total:
-                        tablets_added_count = current_total - previous_total
-                        added_tablets += tablets_added_count
-                        change_info['changes'].append(f"➕ {tablets_added_count} tablillas agregadas")
-                    
-                    # 3. Detectar cambios en lista de tablillas
-                    if current_tablets_list != previous_tablets_list and current_tablets_list and previous_tablets_list:
-                        change_info['changes'].append(f"📝 Lista de tablillas modificada")
-                        change_info['previous_tablets'] = previous_tablets_list
-                        change_info['current_tablets'] = current_tablets_list
-                    
-                    # Solo agregar si hay cambios
-                    if change_info['changes']:
-                        changed_albaranes.append(change_info)
+            closed_tablets = closed_delta.sum()
+            added_tablets = new_rows['Total_Tablets'].sum() + added_delta.sum()
+            changed_albaranes = []
+            
+            # itertuples entrega escalares nativos por fila, sin crear una Series por albarán
+            for row in new_rows.itertuples(name='Row'):
+                # Agregar información del albarán nuevo
+                changed_albaranes.append({
+                    'albaran': row.Index,
+                    'customer': row.Customer_Name,
+                    'previous_open': 0,
+                    'current_open': row.Total_Open,
+                    'previous_total': 0,
+                    'current_total': row.Total_Tablets,
+                    'changes': [f"🆕 Albarán nuevo con {row.Total_Tablets} tablillas"]
+                })
+            
+            # Analizar cambios en albaranes que continúan (solo los que cambiaron)
+            changed_mask = (closed_delta > 0) | (added_delta > 0) | list_changed
+            changed_rows = continuing[changed_mask]
+            
+            for row in changed_rows.itertuples(name='Row'):
+                current_open, previous_open = row.Total_Open, row.Total_Open_prev
+                current_total, previous_total = row.Total_Tablets, row.Total_Tablets_prev
+                current_tablets_list, previous_tablets_list = row.Tablets, row.Tablets_prev
+                
+                # Análisis de cambios
+                change_info = {
+                    'albaran': row.Index,
+                    'customer': row.Customer_Name,
+                    'previous_open': previous_open,
+                    'current_open': current_open,
+                    'previous_total': previous_total,
+                    'current_total': current_total,
+                    'changes': []
+                }
+                
+                # 1. Detectar tablillas cerradas (reducción en Open)
+                if previous_open > current_open:
+                    change_info['changes'].append(f"🔒 {previous_open - current_open} tablillas cerradas")
+                
+                # 2. Detectar tablillas agregadas (aumento en Total)
+                if current_total > previous_total:
+                    change_info['changes'].append(f"➕ {current_total - previous_total} tablillas agregadas")
+                
+                # 3. Detectar cambios en lista de tablillas
+                if current_tablets_list != previous_tablets_list and current_tablets_list and previous_tablets_list:
+                    change_info['changes'].append(f"📝 Lista de tablillas modificada")
+                    change_info['previous_tablets'] = previous_tablets_list
+                    change_info['current_tablets'] = current_tablets_list
+                
+                changed_albaranes.append(change_info)
             
             return {
                 'current_date': current_date,
@@ -357,11 +426,12 @@ class ExcelAnalyzer:
                 'new_albaranes_list': list(new_albaranes),
                 'closed_albaranes_list': list(closed_albaranes),
                 'changed_albaranes': changed_albaranes,
-                'current_total_open': current_df['Total_Open'].sum() if 'Total_Open' in current_df.columns else 0,
-                'previous_total_open': previous_df['Total_Open'].sum() if 'Total_Open' in previous_df.columns else 0,
-                'current_total_albaranes': len(current_df),
-                'previous_total_albaranes': len(previous_df),
-                'albaranes_with_added_tablets': len([c for c in changed_albaranes if any('agregadas' in change for change in c['changes'])])
+                'current_total_open': prepared[current_date]['total_open'],
+                'previous_total_open': prepared[previous_date]['total_open'],
+                'current_total_albaranes': prepared[current_date]['n_rows'],
+                'previous_total_albaranes': prepared[previous_date]['n_rows'],
+                # Solo los continuos con aumento de Total generan el mensaje de "agregadas"
+                'albaranes_with_added_tablets': int((added_delta > 0).sum())
             }
         
         except Exception as e:
@@ -387,26 +457,69 @@ class ExcelAnalyzer:
             'albaranes_with_added_tablets': 0
         }
     
+    def _prepare_for_comparison(self, df: pd.DataFrame) -> Dict:
+        """Datos de un archivo normalizado que reutilizan sus comparaciones y el resumen"""
+        return {
+            'slip_index': self._index_by_slip(df),
+            'total_open': df['Total_Open'].sum(),
+            'n_rows': len(df)
+        }
+    
+    def _index_by_slip(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Columnas de la comparación con una fila por albarán, indexadas por Return_Packing_Slip"""
+        # Total_Open y Total_Tablets ya llegan numéricos desde normalize_dataframe
+        tablets = df['Tablets'].astype(str) if 'Tablets' in df.columns else pd.Series('', index=df.index)
+        indexed = pd.DataFrame({
+            'Total_Open': df['Total_Open'],
+            'Total_Tablets': df['Total_Tablets'] if 'Total_Tablets' in df.columns else 0,
+            'Customer_Name': df['Customer_Name'],
+            'Tablets': tablets,
+            # Huella de 64 bits de la lista: se calcula una vez por archivo y las comparaciones
+            # entre días comparan enteros en lugar de cadenas largas
+            'Tablets_hash': pd.util.hash_array(tablets.to_numpy(dtype=object))
+        })
+        indexed.index = df['Return_Packing_Slip'].astype(str)
+        return indexed[~indexed.index.duplicated()]
+    
     def normalize_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
         """Normalizar DataFrame para comparación - VERSIÓN ROBUSTA"""
         try:
             # Asegurar que las columnas principales existen
             required_columns = ['Return_Packing_Slip', 'Total_Open', 'Customer_Name']
             
+            # Nombres en minúsculas calculados una sola vez; avisos agrupados en un mensaje
+            lowered_columns = [(c, str(c).lower()) for c in df.columns]
+            substitutions = []
+            missing_columns = []
+            
             for col in required_columns:
                 if col not in df.columns:
                     # Buscar columnas similares
-                    similar_cols = [c for c in df.columns if col.lower() in c.lower() or c.lower() in col.lower()]
-                    if similar_cols:
-                        df[col] = df[similar_cols[0]]
-                        st.info(f"🔄 Usando '{similar_cols[0]}' como '{col}'")
+                    col_lower = col.lower()
+                    similar_col = next(
+                        (c for c, c_lower in lowered_columns if col_lower in c_lower or c_lower in col_lower),
+                        None
+                    )
+                    if similar_col is not None:
+                        df[col] = df[similar_col]
+                        substitutions.append(f"'{similar_col}' como '{col}'")
                     else:
                         df[col] = 0 if 'Total' in col else 'N/A'
-                        st.warning(f"⚠️ Columna '{col}' no encontrada, usando valor por defecto")
+                        missing_columns.append(f"'{col}'")
+            
+            if substitutions:
+                st.info(f"🔄 Usando {', '.join(substitutions)}")
+            if missing_columns:
+                st.warning(f"⚠️ Columnas {', '.join(missing_columns)} no encontradas, usando valor por defecto")
+            
+            # Columnas numéricas convertidas en bloque una sola vez (texto y vacíos → 0)
+            for num_col in ('Total_Open', 'Total_Tablets'):
+                if num_col in df.columns:
+                    df[num_col] = pd.to_numeric(df[num_col], errors='coerce').fillna(0).astype('int64')
             
             # NUEVO: Normalizar códigos de almacén en comparaciones
             if 'WH_Code' in df.columns:
-                df['WH_Code'] = df['WH_Code'].str.upper()
+                df['WH_Code'] = uppercase_codes(df['WH_Code'])
                 st.info(f"🔧 Normalizados códigos de almacén para comparación")
             
             return df
@@ -414,7 +527,8 @@ class ExcelAnalyzer:
             st.error(f"❌ Error normalizando DataFrame: {str(e)}")
             return df
     
-    def create_comparison_summary(self, comparisons: List[Dict], excel_data: Dict[str, pd.DataFrame]) -> Dict:
+    def create_comparison_summary(self, comparisons: List[Dict], excel_data: Dict[str, pd.DataFrame],
+                                  prepared: Optional[Dict[str, Dict]] = None) -> Dict:
         """Crear resumen de todas las comparaciones - VERSIÓN ROBUSTA"""
         try:
             if not comparisons:
@@ -428,11 +542,14 @@ class ExcelAnalyzer:
             # Análisis de tendencias
             dates = sorted(excel_data.keys())
             
-            # Evolución de tablillas pendientes
+            # Evolución de tablillas pendientes (total ya calculado al preparar cada archivo)
+            prepared = prepared or {}
             open_evolution = []
             for date in dates:
                 df = excel_data[date]
-                if 'Total_Open' in df.columns:
+                if date in prepared:
+                    total_open = prepared[date]['total_open']
+                elif 'Total_Open' in df.columns:
                     total_open = pd.to_numeric(df['Total_Open'], errors='coerce').fillna(0).sum()
                 else:
                     total_open = 0
@@ -456,6 +573,81 @@ class ExcelAnalyzer:
 class TablillasExtractorPro:
     """Extractor profesional mejorado"""
     
+    # Patrones compilados una sola vez (filas concatenadas y evaluación de calidad)
+    _RE_WH = re.compile(r'(\d+[dD])', re.IGNORECASE)
+    _RE_SLIP = re.compile(r'(729000018\d{3})')
+    _RE_DATE = re.compile(r'(\d{1,2}/\d{1,2}/\d{4})')
+    _RE_JOBSITE = re.compile(r'(4\d{7})')
+    _RE_COST_CENTER = re.compile(r'(FL\d{3})')
+    _RE_DIGIT = re.compile(r'\d')
+    _RE_LINE_BREAK = re.compile(r'[\n\r]')
+    _RE_FL_CONCAT = re.compile(r'^FL([A-Za-z0-9]{2,4})(\d{9,})$')
+    _RE_CUSTOMER = re.compile(r'([A-Za-z\s&,\.]+(?:Corp|Inc|LLC|Ltd|Co))')
+    _RE_QUALITY_SKIP = re.compile('|'.join(map(re.escape, [
+        'Outstanding count', 'Page', 'Return packing', 'Customer name', 'Alsina Forms'
+    ])))
+    
+    # Parsing manual de filas: clientes conocidos en orden de prioridad. Cada
+    # alternativa es un lookahead, así gana el primer cliente de la lista que
+    # aparezca en el texto (igual que buscarlos uno por uno), no el más a la izquierda.
+    _RE_KNOWN_CUSTOMER = re.compile(r'(?s)^(?:' + '|'.join(
+        f'(?=.*?({pattern}))' for pattern in [
+            r'Phorcys Builders Corp',
+            r'Laz Construction',
+            r'Pedreiras Construction[^0-9]*',
+            r'JGR Construction',
+            r'Caribbean Building Corp',
+            r'Thales Builders Corp',
+        ]
+    ) + ')', re.IGNORECASE)
+    _RE_TABLETS = re.compile(r'(\d+,\s*\d+)')
+    _RE_OPEN_CODES = re.compile(r'(\d+M,?\s*\d+M)')
+    _RE_SHORT_NUMBER = re.compile(r'\b(\d{1,2})\b')
+    # Totales del PDF: número de 2-3 dígitos seguido de otro número de 2-3 dígitos
+    _RE_PDF_TOTALS = re.compile(r'\b(\d{2,3})\s+(\d{2,3})\b')
+    _RE_LEADING_NUMBER = re.compile(r'\s*\d{2,3}\b')
+    # Número correlativo del albarán (primer grupo de dígitos)
+    _RE_FIRST_NUMBER = re.compile(r'(\d+)')
+    # Token numérico aislado (separado por espacios), con sufijo M opcional: "226", "1499M"
+    _RE_NUMERIC_TOKEN = re.compile(r'(?<!\S)(\d+M?)(?!\S)')
+    # Formato de fecha de las tablas extraídas del PDF
+    _PDF_DATE_FORMAT = '%m/%d/%Y'
+    
+    # Configuración de Camelot por página (se comparte, no se reconstruye en cada llamada)
+    _PAGE_CONFIGS = {
+        1: {
+            'edge_tol': 500,
+            'row_tol': 10,
+            'column_tol': 0,
+            'description': 'Página 1 - Configuración estándar'
+        },
+        2: {
+            'edge_tol': 400,
+            'row_tol': 8,
+            'column_tol': 5,
+            'description': 'Página 2 - Configuración intermedia'
+        },
+        3: {
+            'edge_tol': 350,
+            'row_tol': 6,
+            'column_tol': 8,
+            'description': 'Página 3 - Configuración estricta'
+        },
+        4: {
+            'edge_tol': 200,
+            'row_tol': 3,
+            'column_tol': 10,
+            'description': 'Página 4 - Configuración muy estricta para columnas concatenadas'
+        },
+        5: {
+            'edge_tol': 250,
+            'row_tol': 4,
+            'column_tol': 12,
+            'description': 'Página 5 - Configuración para futuras páginas'
+        }
+    }
+    _ADAPTIVE_PAGE_CONFIG = {'edge_tol': 200, 'row_tol': 3, 'column_tol': 10}
+    
     def __init__(self):
         self.expected_columns = [
             'WH', 'WH_Code', 'Return_Packing_Slip', 'Return_Date', 'Jobsite_ID',
@@ -465,17 +657,25 @@ class TablillasExtractorPro:
             'Counting_Delay', 'Validation_Delay'
         ]
         self.analyzer = ExcelAnalyzer()
+        # Huellas (forma, hash de contenido) de las tablas ya aceptadas en la extracción actual
+        self._seen_table_hashes = set()
+        # Mensajes de progreso de la extracción, se muestran juntos al terminar
+        self._log_buffer = []
     
-    def extract_from_pdf(self, uploaded_file) -> Optional[pd.DataFrame]:
+    def extract_from_pdf(self, uploaded_file, file_digest: Optional[str] = None) -> Optional[pd.DataFrame]:
         """Extrae datos usando configuraciones múltiples de Camelot con manejo inteligente de páginas"""
-        if not CAMELOT_AVAILABLE:
+        if not camelot_available():
             st.error("⚠️ Camelot no está instalado. Ejecuta: pip install camelot-py[cv]")
             return None
         
+        self._seen_table_hashes.clear()
+        self._log_buffer = []
+        
         try:
-            # Crear archivo temporal
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(uploaded_file.read())
+            # Crear archivo temporal (en tmpfs si está disponible) copiando por bloques de 1 MiB
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', dir=PDF_TMP_DIR) as tmp_file:
+                uploaded_file.seek(0)
+                shutil.copyfileobj(uploaded_file, tmp_file, length=1 << 20)
                 tmp_file_path = tmp_file.name
             
             st.info("🔄 Extrayendo datos con métodos Camelot mejorados...")
@@ -484,16 +684,17 @@ class TablillasExtractorPro:
             all_tables = []
             successful_methods = []
             
-            # Primero, intentar extraer todas las páginas con métodos optimizados
-            all_tables, successful_methods = self._extract_with_multiple_methods(tmp_file_path)
-            
-            # Si no se encontraron tablas, intentar extracción página por página
-            if not all_tables:
-                st.warning("⚠️ Métodos globales fallaron. Intentando extracción página por página...")
-                all_tables, successful_methods = self._extract_page_by_page(tmp_file_path)
-            
-            # Limpiar archivo temporal
-            os.unlink(tmp_file_path)
+            try:
+                # Primero, intentar extraer todas las páginas con métodos optimizados
+                all_tables, successful_methods = self._extract_with_multiple_methods(tmp_file_path)
+                
+                # Si no se encontraron tablas, intentar extracción página por página
+                if not all_tables:
+                    st.warning("⚠️ Métodos globales fallaron. Intentando extracción página por página...")
+                    all_tables, successful_methods = self._extract_page_by_page(tmp_file_path, file_digest)
+            finally:
+                # Limpiar archivo temporal (también si Camelot falla: en tmpfs ocupa memoria)
+                os.unlink(tmp_file_path)
             
             if not all_tables:
                 st.error("❌ No se encontraron tablas en el PDF con ningún método")
@@ -507,22 +708,37 @@ class TablillasExtractorPro:
         except Exception as e:
             st.error(f"❌ Error procesando PDF: {str(e)}")
             return None
+        finally:
+            self._flush_log()
+    
+    def _log(self, message: str):
+        """Acumular un mensaje de progreso de la extracción"""
+        self._log_buffer.append(message)
+    
+    def _flush_log(self):
+        """Mostrar el registro de la extracción en un único bloque"""
+        if self._log_buffer:
+            with st.expander(f"📜 Registro de extracción ({len(self._log_buffer)} mensajes)"):
+                st.markdown('  \n'.join(self._log_buffer))
+            self._log_buffer = []
     
     def _extract_with_multiple_methods(self, tmp_file_path: str) -> Tuple[List, List[str]]:
         """Extraer con métodos adaptativos - ADAPTADO DE APP LOCAL"""
+        camelot = _get_camelot()
         all_tables = []
         successful_methods = []
         
         # MÉTODO 1: Lattice Conservador (mejor para PDFs bien estructurados)
         try:
             st.info("🔄 Probando método Lattice Conservador...")
-            tables = camelot.read_pdf(
-                tmp_file_path, 
-                pages='all', 
-                flavor='lattice',
-                process_background=True,
-                line_scale=40
-            )
+            with _GHOSTSCRIPT_LOCK:
+                tables = camelot.read_pdf(
+                    tmp_file_path, 
+                    pages='all', 
+                    flavor='lattice',
+                    process_background=True,
+                    line_scale=40
+                )
             if len(tables) > 0:
                 all_tables.extend(tables)
                 successful_methods.append("Lattice Conservador")
@@ -533,7 +749,9 @@ class TablillasExtractorPro:
         except Exception as e:
             st.warning(f"⚠️ Error en Lattice Conservador: {str(e)}")
         
-        # MÉTODO 2: Stream Balanceado (parámetros equilibrados)
+        # MÉTODO 2: Stream Balanceado (parámetros equilibrados), solo si Lattice no encontró nada:
+        # una lectura de Camelot en curso no se puede cancelar, y en paralelo seguía analizando
+        # el PDF entero aunque Lattice ya hubiera ganado
         try:
             st.info("🔄 Probando método Stream Balanceado...")
             tables = camelot.read_pdf(
@@ -597,10 +815,9 @@ class TablillasExtractorPro:
         
         return all_tables, successful_methods
     
-    def _separate_merged_row(self, merged_text: str) -> Optional[pd.DataFrame]:
+    def _separate_merged_row(self, merged_text: str) -> Optional[List[str]]:
         """Separa una fila que está toda junta en una sola celda - DE APP LOCAL"""
         try:
-            import re
             # Buscar patrones específicos para separar
             parts = []
             
@@ -608,7 +825,7 @@ class TablillasExtractorPro:
             parts.append('FL')
             
             # 2. Warehouse code (612D, 61D, 28D, 252D, etc.) - MEJORADO
-            wh_match = re.search(r'(\d+[dD])', merged_text, re.IGNORECASE)
+            wh_match = self._RE_WH.search(merged_text)
             if wh_match:
                 wh_code = wh_match.group(1).upper()  # Normalizar a mayúsculas
                 parts.append(wh_code)
@@ -616,31 +833,31 @@ class TablillasExtractorPro:
                 parts.append('612D')  # Default
             
             # 3. Slip number
-            slip_match = re.search(r'(729000018\d{3})', merged_text)
+            slip_match = self._RE_SLIP.search(merged_text)
             parts.append(slip_match.group(1) if slip_match else '')
             
             # 4. Fechas
-            dates = re.findall(r'(\d{1,2}/\d{1,2}/\d{4})', merged_text)
+            dates = self._RE_DATE.findall(merged_text)
             parts.extend(dates[:4])  # Primeras 4 fechas
             while len(parts) < 7:  # Asegurar al menos 7 elementos
                 parts.append('')
             
             # 5. Jobsite (8 dígitos empezando con 4)
-            jobsite_match = re.search(r'(4\d{7})', merged_text)
+            jobsite_match = self._RE_JOBSITE.search(merged_text)
             if jobsite_match:
                 parts.append(jobsite_match.group(1))
             else:
                 parts.append('')
             
             # 6. Cost Center (FLXXX)
-            cost_center_match = re.search(r'(FL\d{3})', merged_text)
+            cost_center_match = self._RE_COST_CENTER.search(merged_text)
             if cost_center_match:
                 parts.append(cost_center_match.group(1))
             else:
                 parts.append('')
             
             # 7. Customer name (texto entre fechas y números)
-            customer_match = re.search(r'([A-Za-z\s&,\.]+(?:Corp|Inc|LLC|Ltd|Co))', merged_text)
+            customer_match = self._RE_CUSTOMER.search(merged_text)
             if customer_match:
                 parts.append(customer_match.group(1).strip())
             else:
@@ -660,7 +877,7 @@ class TablillasExtractorPro:
             while len(parts) < 18:
                 parts.append('')
             
-            return pd.DataFrame([parts[:18]])
+            return parts[:18]
             
         except Exception as e:
             st.warning(f"Error separando fila concatenada: {e}")
@@ -694,32 +911,39 @@ class TablillasExtractorPro:
                         score += 0.1  # Estructura básica
                     
                     # 2. Verificar filas con datos válidos
-                    valid_rows = 0
                     total_rows = len(df)
                     
-                    for idx in df.index:
-                        row_text = ' '.join(str(cell) for cell in df.iloc[idx].values if pd.notna(cell))
-                        if '729000018' in row_text and 'FL' in row_text:
-                            # Evitar headers
-                            if not any(skip in row_text for skip in ['Outstanding count', 'Page', 'Return packing', 'Customer name', 'Alsina Forms']):
-                                valid_rows += 1
+                    # Salida rápida: el número de albarán nunca cruza celdas (el texto de fila
+                    # las une con espacios), así que sin él en ninguna celda solo puntúa la estructura
+                    cells = df.stack().astype(str)
+                    if not cells.str.contains('729000018', regex=False).any():
+                        total_score += min(score, 1.0)
+                        continue
+                    
+                    # Texto de cada fila (celdas no nulas unidas por espacio), construido una sola vez
+                    row_texts = cells.groupby(level=0).agg(' '.join).reindex(df.index, fill_value='')
+                    valid_mask = (
+                        row_texts.str.contains('729000018', regex=False) &
+                        row_texts.str.contains('FL', regex=False) &
+                        # Evitar headers
+                        ~row_texts.str.contains(self._RE_QUALITY_SKIP)
+                    )
+                    valid_rows = int(valid_mask.sum())
                     
                     if total_rows > 0:
                         valid_ratio = valid_rows / total_rows
                         score += valid_ratio * 0.4  # Hasta 0.4 puntos por filas válidas
                     
                     # 3. Verificar secuencia de slips
-                    slip_numbers = []
-                    for idx in df.index:
-                        row_text = ' '.join(str(cell) for cell in df.iloc[idx].values if pd.notna(cell))
-                        slip_match = re.search(r'(729000018\d{3})', row_text)
-                        if slip_match:
-                            slip_numbers.append(int(slip_match.group(1)[-3:]))
+                    slip_numbers = (
+                        row_texts.str.extract(self._RE_SLIP, expand=False)
+                        .dropna().str[-3:].astype(np.int64).to_numpy()
+                    )
                     
                     if len(slip_numbers) > 1:
-                        slip_numbers.sort()
-                        first_slip = slip_numbers[0]
-                        last_slip = slip_numbers[-1]
+                        # Solo importan el primero y el último: min/max en NumPy, sin ordenar
+                        first_slip = slip_numbers.min()
+                        last_slip = slip_numbers.max()
                         expected_count = last_slip - first_slip + 1
                         actual_count = len(slip_numbers)
                         
@@ -742,86 +966,100 @@ class TablillasExtractorPro:
     
     def _get_page_specific_config(self, page_num: int) -> Dict:
         """Obtener configuración específica para cada página"""
-        configs = {
-            1: {
-                'edge_tol': 500,
-                'row_tol': 10,
-                'column_tol': 0,
-                'description': 'Página 1 - Configuración estándar'
-            },
-            2: {
-                'edge_tol': 400,
-                'row_tol': 8,
-                'column_tol': 5,
-                'description': 'Página 2 - Configuración intermedia'
-            },
-            3: {
-                'edge_tol': 350,
-                'row_tol': 6,
-                'column_tol': 8,
-                'description': 'Página 3 - Configuración estricta'
-            },
-            4: {
-                'edge_tol': 200,
-                'row_tol': 3,
-                'column_tol': 10,
-                'description': 'Página 4 - Configuración muy estricta para columnas concatenadas'
-            },
-            5: {
-                'edge_tol': 250,
-                'row_tol': 4,
-                'column_tol': 12,
-                'description': 'Página 5 - Configuración para futuras páginas'
-            }
-        }
-        
         # Para páginas 6+, usar configuración similar a página 4
         if page_num > 5:
-            return {
-                'edge_tol': 200,
-                'row_tol': 3,
-                'column_tol': 10,
-                'description': f'Página {page_num} - Configuración adaptativa'
-            }
+            return {**self._ADAPTIVE_PAGE_CONFIG, 'description': f'Página {page_num} - Configuración adaptativa'}
         
-        return configs.get(page_num, configs[4])  # Default a página 4
+        return self._PAGE_CONFIGS.get(page_num, self._PAGE_CONFIGS[4])  # Default a página 4
     
-    def _extract_page_by_page(self, tmp_file_path: str) -> Tuple[List, List[str]]:
+    def _extract_page_by_page(self, tmp_file_path: str, file_digest: Optional[str] = None) -> Tuple[List, List[str]]:
         """Extraer página por página con métodos específicos para cada página"""
+        camelot = _get_camelot()
         all_tables = []
         successful_methods = []
         
         # Primero, detectar cuántas páginas tiene el PDF
         try:
-            # Intentar extraer la primera página para detectar el número total
+            # Huella para la caché por página: la que ya calculó quien subió el archivo, si la hay
+            if file_digest is None:
+                with open(tmp_file_path, 'rb') as pdf_file:
+                    file_digest = hashlib.sha256(pdf_file.read()).hexdigest()
+            
+            # Intentar extraer la primera página con Stream por defecto para decidir si seguir
             test_tables = camelot.read_pdf(tmp_file_path, pages='1', flavor='stream')
             if test_tables:
-                # Si funciona, intentar detectar el número total de páginas
-                max_pages = 10  # Asumir máximo 10 páginas inicialmente
+                # Si funciona, limitar la extracción al número real de páginas (máximo 10);
+                # así no se lanzan los cuatro métodos sobre páginas que no existen
+                max_pages = min(10, self._count_pdf_pages(tmp_file_path) or 10)
                 st.info(f"🔍 Intentando extracción página por página (máximo {max_pages} páginas)...")
                 
-                for page_num in range(1, max_pages + 1):
-                    page_tables = self._extract_single_page(tmp_file_path, page_num)
-                    if page_tables:
-                        all_tables.extend(page_tables)
-                        successful_methods.append(f"Página {page_num}")
-                        st.write(f"✅ Página {page_num}: {len(page_tables)} tablas encontradas")
-                    else:
-                        # Si no encontramos tablas en esta página, probablemente no hay más páginas
-                        if page_num > 3:  # Solo después de la página 3
-                            break
+                # Las páginas son independientes: se extraen en paralelo y se consumen en orden
+                pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+                futures = [
+                    (page_num, pool.submit(self._extract_single_page_cached, tmp_file_path, file_digest, page_num))
+                    for page_num in range(1, max_pages + 1)
+                ]
+                
+                try:
+                    for page_num, future in futures:
+                        page_tables, page_logs = future.result()
+                        for message in page_logs:
+                            self._log(message)
+                        if page_tables:
+                            all_tables.extend(page_tables)
+                            successful_methods.append(f"Página {page_num}")
+                            self._log(f"✅ Página {page_num}: {len(page_tables)} tablas encontradas")
+                        else:
+                            # Si no encontramos tablas en esta página, probablemente no hay más páginas
+                            if page_num > 3:  # Solo después de la página 3
+                                break
+                finally:
+                    # Cancelar las páginas posteriores al corte que no empezaron y esperar a las
+                    # que ya están en curso: quien llama borra el archivo temporal al volver
+                    pool.shutdown(wait=True, cancel_futures=True)
         except Exception as e:
-            st.write(f"Error en extracción página por página: {str(e)}")
+            self._log(f"Error en extracción página por página: {str(e)}")
         
         return all_tables, successful_methods
     
-    def _extract_single_page(self, tmp_file_path: str, page_num: int) -> List:
+    def _count_pdf_pages(self, tmp_file_path: str) -> Optional[int]:
+        """Contar las páginas del PDF leyendo solo su estructura (None si no es posible)"""
+        try:
+            from PyPDF2 import PdfReader
+            return len(PdfReader(tmp_file_path).pages)
+        except Exception:
+            return None
+    
+    def _extract_single_page_cached(self, tmp_file_path: str, file_digest: str, page_num: int) -> Tuple[List, List[str]]:
+        """Extraer una página reutilizando el resultado si ese mismo PDF ya se procesó"""
+        key = (file_digest, page_num, tuple(sorted(self._get_page_specific_config(page_num).items())))
+        with _PAGE_TABLES_LOCK:
+            if key in _PAGE_TABLES_CACHE:
+                _PAGE_TABLES_CACHE.move_to_end(key)
+                return _PAGE_TABLES_CACHE[key]
+        
+        result = self._extract_single_page(tmp_file_path, page_num)
+        page_tables, _ = result
+        
+        # Una página sin tablas puede venir de un fallo pasajero: no se guarda y se reintenta
+        if page_tables:
+            with _PAGE_TABLES_LOCK:
+                _PAGE_TABLES_CACHE[key] = result
+                _PAGE_TABLES_CACHE.move_to_end(key)
+                while len(_PAGE_TABLES_CACHE) > PAGE_CACHE_SIZE:
+                    _PAGE_TABLES_CACHE.popitem(last=False)
+        return result
+    
+    def _extract_single_page(self, tmp_file_path: str, page_num: int) -> Tuple[List, List[str]]:
         """Extraer una página específica con configuraciones optimizadas por página"""
+        camelot = _get_camelot()
         page_tables = []
+        # Se ejecuta en un hilo de trabajo: los mensajes se devuelven y los muestra el hilo principal
+        logs = []
         
         # Obtener configuración específica para esta página
         config = self._get_page_specific_config(page_num)
-        st.write(f"🔧 {config['description']}")
+        logs.append(f"🔧 {config['description']}")
         
         # Método 1: Stream con configuración específica de la página
         try:
@@ -837,9 +1075,9 @@ class TablillasExtractorPro:
             )
             if len(tables) > 0:
                 page_tables.extend(tables)
-                st.write(f"✅ Página {page_num} - Stream específico exitoso: {len(tables)} tablas")
+                logs.append(f"✅ Página {page_num} - Stream específico exitoso: {len(tables)} tablas")
         except Exception as e:
-            st.write(f"Página {page_num} - Stream específico falló: {str(e)}")
+            logs.append(f"Página {page_num} - Stream específico falló: {str(e)}")
         
         # Método 2: Stream con configuraciones más permisivas (fallback)
         if not page_tables:
@@ -856,26 +1094,27 @@ class TablillasExtractorPro:
                 )
                 if len(tables) > 0:
                     page_tables.extend(tables)
-                    st.write(f"✅ Página {page_num} - Stream permisivo exitoso: {len(tables)} tablas")
+                    logs.append(f"✅ Página {page_num} - Stream permisivo exitoso: {len(tables)} tablas")
             except Exception as e:
-                st.write(f"Página {page_num} - Stream permisivo falló: {str(e)}")
+                logs.append(f"Página {page_num} - Stream permisivo falló: {str(e)}")
         
         # Método 3: Lattice para páginas con líneas definidas
         if not page_tables:
             try:
-                tables = camelot.read_pdf(
-                    tmp_file_path, 
-                    pages=str(page_num), 
-                    flavor='lattice',
-                    process_background=True,
-                    line_scale=20,          # Escala más alta para líneas más visibles
-                    copy_text=['v']         # Copiar texto vertical
-                )
+                with _GHOSTSCRIPT_LOCK:
+                    tables = camelot.read_pdf(
+                        tmp_file_path, 
+                        pages=str(page_num), 
+                        flavor='lattice',
+                        process_background=True,
+                        line_scale=20,          # Escala más alta para líneas más visibles
+                        copy_text=['v']         # Copiar texto vertical
+                    )
                 if len(tables) > 0:
                     page_tables.extend(tables)
-                    st.write(f"✅ Página {page_num} - Lattice exitoso: {len(tables)} tablas")
+                    logs.append(f"✅ Página {page_num} - Lattice exitoso: {len(tables)} tablas")
             except Exception as e:
-                st.write(f"Página {page_num} - Lattice falló: {str(e)}")
+                logs.append(f"Página {page_num} - Lattice falló: {str(e)}")
         
         # Método 4: Stream con configuración ultra-estricta para páginas problemáticas (especialmente página 4+)
         if not page_tables and page_num >= 4:
@@ -893,22 +1132,20 @@ class TablillasExtractorPro:
                 )
                 if len(tables) > 0:
                     page_tables.extend(tables)
-                    st.write(f"✅ Página {page_num} - Stream ultra-estricto exitoso: {len(tables)} tablas")
+                    logs.append(f"✅ Página {page_num} - Stream ultra-estricto exitoso: {len(tables)} tablas")
             except Exception as e:
-                st.write(f"Página {page_num} - Stream ultra-estricto falló: {str(e)}")
+                logs.append(f"Página {page_num} - Stream ultra-estricto falló: {str(e)}")
         
-        return page_tables
-    
-    def _is_duplicate_table(self, new_table, existing_tables: List) -> bool:
-        """Verificar si una tabla es duplicada"""
-        if not existing_tables:
-            return False
-        
-        # Comparar dimensiones y contenido básico
-        for existing_table in existing_tables:
-            if (new_table.shape == existing_table.shape and 
-                new_table.df.equals(existing_table.df)):
-                return True
+        return page_tables, logs
+    
+    def _is_duplicate_table(self, new_table) -> bool:
+        """Verificar si una tabla es duplicada y registrarla si es nueva"""
+        # Huella por dimensiones y contenido: búsqueda O(1) en lugar de comparar con cada tabla
+        row_hashes = pd.util.hash_pandas_object(new_table.df, index=False)
+        key = (tuple(new_table.shape), hash(row_hashes.to_numpy().tobytes()))
+        if key in self._seen_table_hashes:
+            return True
+        self._seen_table_hashes.add(key)
         return False
     
     def _filter_valid_fl_rows(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -918,139 +1155,148 @@ class TablillasExtractorPro:
                 return df
             
             valid_rows = []
-            
-            for idx in df.index:
-                first_col = str(df.iloc[idx, 0]).strip()
+            # Posiciones de filas FL válidas pendientes de copiar como un solo bloque
+            keep_positions = []
+            # Filas concatenadas ya separadas (18 valores) pendientes de convertir en un bloque
+            separated_rows = []
+            
+            def _flush_separated_rows():
+                if separated_rows:
+                    valid_rows.append(pd.DataFrame(separated_rows))
+                    separated_rows.clear()
+            
+            def _flush_kept_rows():
+                if not keep_positions:
+                    return
+                block = df.iloc[keep_positions].reset_index(drop=True)
+                
+                # Normalizar warehouse en columna 1 (índice 1) - buscar 612d y convertir a 612D
+                if len(block.columns) > 1:
+                    # Buscar el patrón de warehouse code de toda la columna de una vez; solo las
+                    # celdas cuyo código termina en 'd' minúscula necesitan reescribirse
+                    wh_cells = block.iloc[:, 1].astype(str)
+                    wh_codes = wh_cells.str.extract(self._RE_WH, expand=False)
+                    lowercase = wh_codes.str.endswith('d').fillna(False).to_numpy(dtype=bool)
+                    if lowercase.any():
+                        block.iloc[lowercase, 1] = [
+                            wh_cell.replace(wh_code, wh_code.upper())
+                            for wh_cell, wh_code in zip(wh_cells[lowercase], wh_codes[lowercase])
+                        ]
                 
-                # NUEVO: Verificar si toda la fila está concatenada en una sola celda
-                if len(first_col) > 100 and '729000018' in first_col and 'FL' in first_col:
-                    st.warning(f"⚠️ Fila concatenada detectada, separando...")
+                valid_rows.append(block)
+                keep_positions.clear()
+            
+            first_col_values = df.iloc[:, 0].astype(str).str.strip()
+            
+            # NUEVO: Verificar si toda la fila está concatenada en una sola celda
+            merged_mask = (first_col_values.str.len().gt(100)
+                           & first_col_values.str.contains('729000018', regex=False)
+                           & first_col_values.str.contains('FL', regex=False)).to_numpy()
+            # Verificar si la fila empieza con FL; el resto se descarta sin recorrerlo en Python
+            candidates = merged_mask | first_col_values.str.startswith('FL').to_numpy()
+            # NUEVO: Validar que la fila tenga datos suficientes (todas las filas de una vez)
+            valid_mask = self._valid_fl_row_mask(df)
+            
+            # Los avisos de filas concatenadas se resumen al final: un mensaje por fila
+            # supondría un envío a Streamlit por cada una
+            merged_count = int(merged_mask.sum())
+            separated_count = 0
+            
+            for pos in np.flatnonzero(candidates):
+                first_col = first_col_values.iat[pos]
+                if merged_mask[pos]:
                     separated_row = self._separate_merged_row(first_col)
                     if separated_row is not None:
-                        # Agregar la fila separada como una nueva fila válida
-                        valid_rows.append(separated_row)
-                        st.success(f"✅ Fila concatenada separada exitosamente")
-                    continue
-                
-                # Verificar si la fila empieza con FL
-                if not first_col.startswith('FL'):
+                        # Agregar la fila separada como una nueva fila válida, respetando el orden
+                        _flush_kept_rows()
+                        separated_rows.append(separated_row)
+                        separated_count += 1
                     continue
                 
-                # NUEVO: Validar que la fila tenga datos suficientes
-                if self._is_valid_fl_row(df.iloc[idx]):
-                    # NUEVO: Normalizar warehouse codes antes de agregar
-                    row_data = df.iloc[idx:idx+1].copy()
-                    
-                    # Normalizar warehouse en columna 1 (índice 1) - buscar 612d y convertir a 612D
-                    if len(row_data.columns) > 1:
-                        wh_cell = str(row_data.iloc[0, 1])
-                        # Buscar cualquier patrón de warehouse code y normalizar
-                        wh_match = re.search(r'(\d+[dD])', wh_cell, re.IGNORECASE)
-                        if wh_match:
-                            normalized_wh = wh_match.group(1).upper()
-                            wh_cell = wh_cell.replace(wh_match.group(1), normalized_wh)
-                            row_data.iloc[0, 1] = wh_cell
-                    
-                    valid_rows.append(row_data)
+                if valid_mask[pos]:
+                    _flush_separated_rows()
+                    keep_positions.append(pos)
                 else:
-                    st.write(f"⚠️ Fila FL incompleta descartada: {first_col}")
+                    self._log(f"⚠️ Fila FL incompleta descartada: {first_col}")
+            
+            _flush_kept_rows()
+            _flush_separated_rows()
+            
+            if merged_count:
+                st.warning(f"⚠️ {merged_count} filas concatenadas detectadas, separando...")
+                if separated_count:
+                    st.success(f"✅ {separated_count} filas concatenadas separadas exitosamente")
             
             if valid_rows:
-                # Si tenemos filas separadas (DataFrames), concatenarlas
-                if isinstance(valid_rows[0], pd.DataFrame):
-                    return pd.concat(valid_rows, ignore_index=True)
-                else:
-                    return df.loc[valid_rows].reset_index(drop=True)
+                # Sin filas separadas hay un único bloque: se devuelve sin volver a copiarlo
+                result = valid_rows[0] if len(valid_rows) == 1 else pd.concat(valid_rows, ignore_index=True)
+                # Todas las filas empiezan con FL: la validación posterior puede omitir el recuento
+                result.attrs['fl_prevalidated'] = True
+                return result
             else:
                 return pd.DataFrame()
                 
         except Exception as e:
             st.warning(f"⚠️ Error filtrando filas FL: {str(e)}")
             # Fallback: usar método original
-            return df[df.iloc[:, 0].astype(str).str.contains('FL', na=False)]
+            return df[df.iloc[:, 0].astype(str).str.contains('FL', regex=False)]
     
-    def _is_valid_fl_row(self, row) -> bool:
-        """Validar si una fila FL tiene datos suficientes y válidos"""
-        try:
-            first_col = str(row.iloc[0]).strip()
-            
-            # Verificar que empiece con FL
-            if not first_col.startswith('FL'):
-                return False
-            
-            # Verificar que tenemos suficientes columnas con datos para una fila válida
-            non_empty_cols = 0
-            for i in range(min(10, len(row))):  # Revisar primeras 10 columnas
-                if pd.notna(row.iloc[i]) and str(row.iloc[i]).strip() != '' and str(row.iloc[i]).strip() != 'nan':
-                    non_empty_cols += 1
-            
-            # NUEVO: Criterio más flexible - mínimo 3 columnas con datos
-            # Esto permite que páginas con menos columnas (como página 4) sean válidas
-            if non_empty_cols < 3:
-                return False
-            
-            # NUEVO: Validación más flexible para páginas con menos columnas
-            # Verificar que la segunda columna no esté vacía (debería ser WH_Code)
-            if len(row) > 1:
-                second_col = str(row.iloc[1]).strip()
-                if not second_col or second_col == '' or second_col == 'nan':
-                    return False
-            
-            # Verificar que la tercera columna no esté vacía (debería ser Return_Packing_Slip)
-            if len(row) > 2:
-                third_col = str(row.iloc[2]).strip()
-                if not third_col or third_col == '' or third_col == 'nan':
-                    return False
-            
-            # NUEVO: Solo verificar Return_Date si hay suficientes columnas
-            # Esto permite que páginas con menos columnas (como página 4) sean válidas
-            if len(row) > 3:
-                fourth_col = str(row.iloc[3]).strip()
-                # Solo rechazar si la columna existe pero está vacía
-                if fourth_col == '' or fourth_col == 'nan':
-                    return False
-            
-            # NUEVO: Validación más flexible para patrones FL
-            # Verificar que no sea solo "FL" con muy pocos datos
-            if first_col == 'FL' and non_empty_cols < 3:  # Reducido de 5 a 3
-                return False
-            
-            # NUEVO: Validación más flexible para patrones FL052, etc.
-            # Verificar que no sea un patrón como "FL052" sin datos reales
-            if first_col in ['FL052', 'FL051', 'FL050'] and non_empty_cols < 4:  # Reducido de 6 a 4
-                return False
-            
-            # NUEVO: Detectar patrones problemáticos con saltos de línea
-            if '\n' in first_col or '\r' in first_col:
-                return False
-            
-            # NUEVO: Detectar patrones con comillas dobles (datos mal formateados)
-            if first_col.startswith('"') and first_col.endswith('"'):
-                # Verificar si el contenido dentro de las comillas es válido
-                inner_content = first_col[1:-1].strip()
-                if '\n' in inner_content or len(inner_content.split()) > 3:
-                    return False
-            
-            return True
-            
-        except Exception as e:
-            st.warning(f"⚠️ Error validando fila FL: {str(e)}")
-            return False
+    def _valid_fl_row_mask(self, df: pd.DataFrame) -> np.ndarray:
+        """Validar qué filas FL tienen datos suficientes y válidos (una máscara para todo el DataFrame)"""
+        if df.empty or len(df.columns) == 0:
+            return np.zeros(len(df), dtype=bool)
+        
+        # Primeras 10 columnas convertidas a texto una sola vez
+        head = df.iloc[:, :10]
+        texts = [head.iloc[:, col_idx].astype(str).str.strip() for col_idx in range(head.shape[1])]
+        first_col = texts[0]
+        
+        # Verificar que empiece con FL
+        mask = first_col.str.startswith('FL').to_numpy()
+        
+        # Verificar que tenemos suficientes columnas con datos para una fila válida
+        filled = [
+            head.iloc[:, col_idx].notna().to_numpy() & ~text.isin(['', 'nan']).to_numpy()
+            for col_idx, text in enumerate(texts)
+        ]
+        non_empty_cols = np.sum(filled, axis=0)
+        
+        # NUEVO: Criterio más flexible - mínimo 3 columnas con datos
+        # Esto permite que páginas con menos columnas (como página 4) sean válidas
+        mask &= non_empty_cols >= 3
+        
+        # NUEVO: Validación más flexible para páginas con menos columnas
+        # Verificar que la segunda (WH_Code) y tercera (Return_Packing_Slip) columnas no estén vacías
+        # y, si existe, que Return_Date tampoco lo esté (páginas como la 4 tienen menos columnas)
+        for text in texts[1:4]:
+            mask &= ~text.isin(['', 'nan']).to_numpy()
+        
+        # NUEVO: Validación más flexible para patrones FL052, etc.
+        # Verificar que no sea un patrón como "FL052" sin datos reales
+        mask &= ~(first_col.isin(['FL052', 'FL051', 'FL050']).to_numpy() & (non_empty_cols < 4))
+        
+        # NUEVO: Detectar patrones problemáticos con saltos de línea
+        mask &= ~first_col.str.contains(self._RE_LINE_BREAK).to_numpy()
+        
+        # (Una celda entre comillas dobles nunca empieza con FL: no requiere regla adicional)
+        return mask
     
     def _validate_and_improve_extraction(self, df: pd.DataFrame) -> pd.DataFrame:
         """Validar y mejorar la calidad de la extracción"""
         try:
             st.info("🔍 Validando calidad de extracción...")
             
-            # Contar filas FL válidas
-            fl_rows = df[df.iloc[:, 0].astype(str).str.contains('FL', na=False)]
+            # Contar filas FL válidas (si vienen de _filter_valid_fl_rows ya son todas FL)
             total_rows = len(df)
-            fl_count = len(fl_rows)
+            if df.attrs.get('fl_prevalidated'):
+                fl_count = total_rows
+            else:
+                fl_count = int(df.iloc[:, 0].astype(str).str.contains('FL', regex=False).sum())
             
-            st.write(f"📊 Estadísticas de extracción:")
-            st.write(f"   - Total de filas: {total_rows}")
-            st.write(f"   - Filas FL válidas: {fl_count}")
-            st.write(f"   - Tasa de éxito: {(fl_count/total_rows*100):.1f}%" if total_rows > 0 else "   - Tasa de éxito: 0%")
+            self._log(f"📊 Estadísticas de extracción:")
+            self._log(f"   - Total de filas: {total_rows}")
+            self._log(f"   - Filas FL válidas: {fl_count}")
+            self._log(f"   - Tasa de éxito: {(fl_count/total_rows*100):.1f}%" if total_rows > 0 else "   - Tasa de éxito: 0%")
             
             # Si la tasa de éxito es muy baja, intentar correcciones adicionales
             if fl_count < total_rows * 0.5:  # Menos del 50% de filas válidas
@@ -1078,20 +1324,21 @@ class TablillasExtractorPro:
             corrections_made = 0
             
             # Buscar patrones que podrían ser FL pero no fueron detectados
-            for idx in df.index:
-                first_col = str(df.iloc[idx, 0]).strip()
-                
-                # Patrón: números largos que podrían ser Return_Packing_Slip
-                if first_col.isdigit() and len(first_col) >= 9:
-                    # Verificar si hay un WH_Code en la columna siguiente
-                    if len(df.columns) > 1:
-                        second_col = str(df.iloc[idx, 1]).strip()
-                        if len(second_col) <= 4 and not second_col.isdigit():
-                            # Reorganizar: FL, WH_Code, Return_Packing_Slip
-                            df.iloc[idx, 0] = "FL"
-                            df.iloc[idx, 1] = second_col
-                            df.iloc[idx, 2] = first_col
-                            corrections_made += 1
+            # (hacen falta las tres columnas FL, WH_Code y Return_Packing_Slip)
+            if len(df.columns) > 2:
+                first_col = df.iloc[:, 0].astype(str).str.strip()
+                second_col = df.iloc[:, 1].astype(str).str.strip()
+                
+                # Patrón: números largos que podrían ser Return_Packing_Slip,
+                # con un WH_Code en la columna siguiente
+                mask = (first_col.str.isdigit() & first_col.str.len().ge(9)
+                        & second_col.str.len().le(4) & ~second_col.str.isdigit()).to_numpy()
+                if mask.any():
+                    # Reorganizar: FL, WH_Code, Return_Packing_Slip
+                    df.iloc[mask, 0] = "FL"
+                    df.iloc[mask, 1] = second_col.to_numpy()[mask]
+                    df.iloc[mask, 2] = first_col.to_numpy()[mask]
+                    corrections_made = int(mask.sum())
             
             if corrections_made > 0:
                 st.success(f"✅ {corrections_made} correcciones adicionales aplicadas")
@@ -1109,21 +1356,26 @@ class TablillasExtractorPro:
             if len(df.columns) < 8:
                 st.info("🔧 Detectadas pocas columnas. Verificando si hay datos concatenados...")
                 
+                # Partes a escribir por columna {col_idx: {fila: valor}}; se escriben en bloque al final
+                written = {}
+                
                 # Buscar filas con datos muy largos en la primera columna
-                for idx in df.index:
-                    first_col = str(df.iloc[idx, 0]).strip()
+                first_col_values = df.iloc[:, 0].astype(str).str.strip() if len(df.columns) else []
+                for row_pos, first_col in enumerate(first_col_values):
                     if len(first_col) > 20:  # Datos muy largos
                         # Intentar separar por espacios
                         parts = first_col.split()
                         if len(parts) >= 3:
                             # Expandir a más columnas
                             for i, part in enumerate(parts[:min(8, len(parts))]):
-                                if i < len(df.columns):
-                                    df.iloc[idx, i] = part
-                                else:
-                                    # Agregar nueva columna si es necesario
-                                    df[f'Col_{i+1}'] = ''
-                                    df.iloc[idx, i] = part
+                                written.setdefault(i, {})[row_pos] = part
+                
+                for col_idx in sorted(written):
+                    if col_idx >= len(df.columns):
+                        # Agregar nueva columna si es necesario
+                        df[f'Col_{col_idx+1}'] = ''
+                    cells = written[col_idx]
+                    df.iloc[list(cells), col_idx] = list(cells.values())
             
             return df
             
@@ -1136,45 +1388,56 @@ class TablillasExtractorPro:
         all_data = []
         
         for i, table in enumerate(tables):
-            st.write(f"🔍 Procesando tabla {i+1}: {table.shape[0]} filas, {table.shape[1]} columnas")
+            self._log(f"🔍 Procesando tabla {i+1}: {table.shape[0]} filas, {table.shape[1]} columnas")
             
             df = table.df
             
             # NUEVO: Análisis detallado de la estructura de columnas
             if i == 0:  # Solo mostrar para la primera tabla
                 st.info("📋 **Análisis de estructura de columnas:**")
-                st.write(f"- **Página 1**: {table.shape[1]} columnas")
+                self._log(f"- **Página 1**: {table.shape[1]} columnas")
                 # Guardar estructura de referencia
                 self._reference_columns = list(df.columns)
             elif i == 3:  # Página 4
-                st.write(f"- **Página 4**: {table.shape[1]} columnas ⚠️ (Estructura diferente)")
+                self._log(f"- **Página 4**: {table.shape[1]} columnas ⚠️ (Estructura diferente)")
                 self._analyze_column_differences(df, i+1)
             elif i == 4:  # Página 5
-                st.write(f"- **Página 5**: {table.shape[1]} columnas")
+                self._log(f"- **Página 5**: {table.shape[1]} columnas")
                 self._analyze_column_differences(df, i+1)
             elif i == 5:  # Página 6
-                st.write(f"- **Página 6**: {table.shape[1]} columnas")
+                self._log(f"- **Página 6**: {table.shape[1]} columnas")
                 self._analyze_column_differences(df, i+1)
             elif i == 6:  # Página 7
-                st.write(f"- **Página 7**: {table.shape[1]} columnas")
+                self._log(f"- **Página 7**: {table.shape[1]} columnas")
                 self._analyze_column_differences(df, i+1)
             elif i == 7:  # Página 8
-                st.write(f"- **Página 8**: {table.shape[1]} columnas")
+                self._log(f"- **Página 8**: {table.shape[1]} columnas")
                 self._analyze_column_differences(df, i+1)
             
             # NUEVO: Filtrar y validar filas FL con criterios más estrictos
             fl_rows = self._filter_valid_fl_rows(df)
             
             if len(fl_rows) > 0:
-                st.write(f"✅ {len(fl_rows)} filas FL válidas encontradas en tabla {i+1}")
+                self._log(f"✅ {len(fl_rows)} filas FL válidas encontradas en tabla {i+1}")
                 all_data.append(fl_rows)
         
         if not all_data:
             st.error("❌ No se encontraron filas con datos FL")
             return None
         
-        # Combinar todas las tablas FL
-        combined_df = pd.concat(all_data, ignore_index=True)
+        # Combinar todas las tablas FL: con las columnas posicionales de Camelot (0..n) se
+        # rellena un único arreglo preasignado en lugar de que concat alinee cada DataFrame
+        if all(chunk.columns.equals(pd.RangeIndex(chunk.shape[1])) for chunk in all_data):
+            combined = np.full((sum(len(chunk) for chunk in all_data), max(chunk.shape[1] for chunk in all_data)),
+                               np.nan, dtype=object)
+            offset = 0
+            for chunk in all_data:
+                combined[offset:offset + len(chunk), :chunk.shape[1]] = chunk.to_numpy(dtype=object)
+                offset += len(chunk)
+            combined_df = pd.DataFrame(combined)
+        else:
+            combined_df = pd.concat(all_data, ignore_index=True)
+        combined_df.attrs['fl_prevalidated'] = all(chunk.attrs.get('fl_prevalidated') for chunk in all_data)
         
         # NUEVO: Validar y mejorar la extracción antes de limpiar
         combined_df = self._validate_and_improve_extraction(combined_df)
@@ -1189,174 +1452,162 @@ class TablillasExtractorPro:
             
             # Crear copia para trabajar
             fixed_df = df.copy()
-            corrections_made = 0
             
-            # Verificar si la primera columna contiene patrones problemáticos
-            for idx in fixed_df.index:
-                first_col = str(fixed_df.iloc[idx, 0]).strip()
-                
-                # NUEVO: Patrón específico para 4ta página - "FL61D729040036567"
-                if first_col.startswith('FL') and len(first_col) > 10 and not ' ' in first_col:
-                    # Extraer componentes usando regex
-                    import re
-                    
-                    # Patrón: FL + WH_Code (2-4 caracteres) + Return_Packing_Slip (9+ dígitos)
-                    pattern = r'^FL([A-Za-z0-9]{2,4})(\d{9,})$'
-                    match = re.match(pattern, first_col)
-                    
-                    if match:
-                        wh_code = match.group(1)
-                        return_slip = match.group(2)
-                        
-                        # Separar correctamente
-                        fixed_df.iloc[idx, 0] = "FL"
-                        
-                        if len(fixed_df.columns) > 1:
-                            fixed_df.iloc[idx, 1] = wh_code
-                        
-                        if len(fixed_df.columns) > 2:
-                            fixed_df.iloc[idx, 2] = return_slip
-                        
-                        corrections_made += 1
-                        continue
-                
-                # NUEVO: Patrón para filas incompletas como "FL052" sin más datos
-                if first_col == 'FL' or (first_col.startswith('FL') and len(first_col) <= 6):
-                    # Verificar si las columnas siguientes están vacías
-                    has_data = False
-                    for col_idx in range(1, min(5, len(fixed_df.columns))):
-                        if pd.notna(fixed_df.iloc[idx, col_idx]) and str(fixed_df.iloc[idx, col_idx]).strip() != '':
-                            has_data = True
-                            break
-                    
-                    if not has_data:
-                        # Esta fila está incompleta, marcarla para descarte posterior
-                        st.write(f"⚠️ Fila incompleta detectada: {first_col} - será descartada")
-                        continue
+            n_cols = len(fixed_df.columns)
+            
+            # Texto limpio de cada columna, calculado una vez y descartado solo al modificarla
+            text_cache = {}
+            
+            def _as_text(col_idx: int) -> pd.Series:
+                if col_idx not in text_cache:
+                    text_cache[col_idx] = fixed_df.iloc[:, col_idx].astype(str).str.strip()
+                return text_cache[col_idx]
+            
+            def _is_blank(col_idx: int) -> np.ndarray:
+                return (fixed_df.iloc[:, col_idx].isna() | (_as_text(col_idx) == '')).to_numpy()
+            
+            def _assign(mask: np.ndarray, col_idx: int, values) -> None:
+                if col_idx < n_cols and mask.any():
+                    if isinstance(values, pd.Series):
+                        values = values.to_numpy()[mask]
+                    fixed_df.iloc[mask, col_idx] = values
+                    text_cache.pop(col_idx, None)
+            
+            # Todas las reglas de fila dependen solo de la primera columna original
+            first_col = _as_text(0) if n_cols else pd.Series(index=fixed_df.index, dtype=object)
+            
+            # NUEVO: Patrón específico para 4ta página - "FL61D729040036567"
+            # Patrón: FL + WH_Code (2-4 caracteres) + Return_Packing_Slip (9+ dígitos)
+            concatenated = first_col.str.extract(self._RE_FL_CONCAT)
+            concat_mask = concatenated[0].notna().to_numpy()
+            
+            # NUEVO: Patrón para filas incompletas como "FL052" sin más datos
+            short_fl = (first_col.eq('FL') | (first_col.str.startswith('FL') & (first_col.str.len() <= 6))).to_numpy()
+            short_fl &= ~concat_mask
+            has_data = np.zeros(len(fixed_df), dtype=bool)
+            for col_idx in range(1, min(5, n_cols)):
+                has_data |= ~_is_blank(col_idx)
+            incomplete_mask = short_fl & ~has_data
+            for value in first_col[incomplete_mask]:
+                # Esta fila está incompleta, marcarla para descarte posterior
+                self._log(f"⚠️ Fila incompleta detectada: {value} - será descartada")
+            
+            # Patrón original: "FL 612D 729000018764" o similar
+            parts = first_col.str.split(expand=True)
+            n_parts = first_col.str.split().str.len().to_numpy()
+            pending = ~concat_mask & ~incomplete_mask
+            spaced_fl_mask = pending & first_col.str.startswith('FL ').to_numpy()
+            spaced_fl_split = spaced_fl_mask & (n_parts >= 3)
+            
+            # Patrón alternativo: Primera columna solo tiene "612D 729000018764" sin FL
+            # (separados por un espacio literal; otros blancos como saltos de línea no cuentan)
+            bare_mask = pending & ~spaced_fl_mask & (n_parts == 2) & first_col.str.contains(' ', regex=False).to_numpy()
+            if bare_mask.any():
+                bare_mask &= (parts[0].str.len().le(4)
+                              & parts[1].str.len().ge(10)
+                              & parts[1].str.isdigit()).fillna(False).to_numpy(dtype=bool)
+            
+            # Contenido original de la fila para desplazarlo a la derecha
+            original = fixed_df.copy() if bare_mask.any() else None
+            
+            # Separar correctamente
+            _assign(concat_mask, 0, 'FL')
+            _assign(concat_mask, 1, concatenated[0])
+            _assign(concat_mask, 2, concatenated[1])
+            
+            if spaced_fl_split.any():
+                _assign(spaced_fl_split, 0, parts[0])  # "FL"
+                _assign(spaced_fl_split, 1, parts[1])  # WH_Code como "612D"
+                _assign(spaced_fl_split, 2, parts[2])  # Return_Packing_Slip como "729000018764"
+                # Mover el resto de contenido hacia la derecha solo mientras la celda destino esté vacía
+                still_filling = spaced_fl_split.copy()
+                for col_idx in range(3, min(n_cols, parts.shape[1])):
+                    still_filling &= parts[col_idx].notna().to_numpy() & _is_blank(col_idx)
+                    _assign(still_filling, col_idx, parts[col_idx])
+            
+            # Insertar FL al principio y mover contenido hacia la derecha
+            if bare_mask.any():
+                _assign(bare_mask, 0, 'FL')
+                _assign(bare_mask, 1, parts[0])
+                if n_cols > 2:
+                    _assign(bare_mask, 2, parts[1])
+                    for col_idx in range(3, n_cols):
+                        previous = original.iloc[:, col_idx - 1]
+                        keep = (previous.notna() & (previous.astype(str).str.strip() != '')).to_numpy()
+                        _assign(bare_mask & keep, col_idx, previous)
+            
+            corrections_made = int(concat_mask.sum() + spaced_fl_split.sum() + bare_mask.sum())
+            
+            # NUEVO: Patrón para columnas con datos concatenados en otras posiciones
+            # Se recorre columna a columna porque cada corrección puede rellenar la siguiente
+            scan_rows = ~concat_mask & ~incomplete_mask
+            for col_idx in range(1, min(5, n_cols)):  # Revisar primeras 5 columnas
+                cell_value = _as_text(col_idx)
                 
-                # Patrón original: "FL 612D 729000018764" o similar
-                if first_col.startswith('FL '):
-                    parts = first_col.split()
-                    
-                    if len(parts) >= 3:
-                        # Separar correctamente
-                        fixed_df.iloc[idx, 0] = parts[0]  # "FL"
-                        
-                        # Si tenemos suficientes columnas, distribuir
-                        if len(fixed_df.columns) > 1:
-                            fixed_df.iloc[idx, 1] = parts[1]  # WH_Code como "612D"
-                        
-                        if len(fixed_df.columns) > 2:
-                            fixed_df.iloc[idx, 2] = parts[2]  # Return_Packing_Slip como "729000018764"
-                        
-                        # Mover el resto de contenido hacia la derecha si es necesario
-                        remaining_parts = parts[3:] if len(parts) > 3 else []
-                        for i, part in enumerate(remaining_parts, start=3):
-                            if i < len(fixed_df.columns):
-                                # Solo reemplazar si la celda está vacía
-                                current_val = fixed_df.iloc[idx, i]
-                                if pd.isna(current_val) or str(current_val).strip() == '':
-                                    fixed_df.iloc[idx, i] = part
-                                else:
-                                    # Insertar nuevo contenido desplazando el existente
-                                    break
-                        
-                        corrections_made += 1
+                # Detectar patrones como "4992226M 2" o "11671M 1"
+                suffixed = (cell_value.str.contains('M ', regex=False)
+                            | cell_value.str.contains('T ', regex=False)).to_numpy()
+                cell_parts = cell_value.str.split()
+                split_mask = scan_rows & suffixed & (cell_parts.str.len() == 2).to_numpy()
+                if not split_mask.any():
+                    continue
                 
-                # Patrón alternativo: Primera columna solo tiene "612D 729000018764" sin FL
-                elif ' ' in first_col and len(first_col.split()) == 2:
-                    parts = first_col.split()
-                    
-                    # Verificar si parece WH_Code + Return_Packing_Slip
-                    if (len(parts[0]) <= 4 and  # WH_Code corto
-                        len(parts[1]) >= 10 and parts[1].isdigit()):  # Return_Packing_Slip largo
-        
-                        # Insertar FL al principio y separar
-                        fixed_df.iloc[idx, 0] = "FL"
-                        
-                        # Mover contenido hacia la derecha
-                        if len(fixed_df.columns) > 1:
-                            # Guardar contenido actual de las columnas siguientes
-                            old_content = [fixed_df.iloc[idx, i] for i in range(1, len(fixed_df.columns))]
-                            
-                            # Colocar WH_Code en segunda posición
-                            fixed_df.iloc[idx, 1] = parts[0]
-                            
-                            # Colocar Return_Packing_Slip en tercera posición
-                            if len(fixed_df.columns) > 2:
-                                fixed_df.iloc[idx, 2] = parts[1]
-                                
-                                # Mover el contenido restante una posición a la derecha
-                                for i, val in enumerate(old_content[1:], start=3):
-                                    if i < len(fixed_df.columns) and not pd.isna(val) and str(val).strip():
-                                        fixed_df.iloc[idx, i] = val
-                        
-                        corrections_made += 1
+                # Separar valor y sufijo
+                _assign(split_mask, col_idx, cell_parts.str[0])  # "4992226M"
                 
-                # NUEVO: Patrón para columnas con datos concatenados en otras posiciones
-                for col_idx in range(1, min(5, len(fixed_df.columns))):  # Revisar primeras 5 columnas
-                    cell_value = str(fixed_df.iloc[idx, col_idx]).strip()
-                    
-                    # Detectar patrones como "4992226M 2" o "11671M 1"
-                    if 'M ' in cell_value or 'T ' in cell_value:
-                        parts = cell_value.split()
-                        if len(parts) == 2:
-                            # Separar valor y sufijo
-                            fixed_df.iloc[idx, col_idx] = parts[0]  # "4992226M"
-                            
-                            # Si hay una columna siguiente, poner el número
-                            if col_idx + 1 < len(fixed_df.columns):
-                                current_next = str(fixed_df.iloc[idx, col_idx + 1]).strip()
-                                if pd.isna(fixed_df.iloc[idx, col_idx + 1]) or current_next == '' or current_next == '0':
-                                    fixed_df.iloc[idx, col_idx + 1] = parts[1]  # "2"
-                                    corrections_made += 1
+                # Si hay una columna siguiente vacía o en cero, poner el número
+                if col_idx + 1 < n_cols:
+                    next_empty = (fixed_df.iloc[:, col_idx + 1].isna() | _as_text(col_idx + 1).isin(['', '0'])).to_numpy()
+                    _assign(split_mask & next_empty, col_idx + 1, cell_parts.str[1])  # "2"
+                    corrections_made += int((split_mask & next_empty).sum())
             
             # NUEVO: Limpiar columnas con datos mixtos como "1674, 1711"
-            for col_idx in range(len(fixed_df.columns)):
-                for idx in fixed_df.index:
-                    cell_value = str(fixed_df.iloc[idx, col_idx]).strip()
-                    
-                    # Detectar patrones con comas y múltiples números
-                    if ',' in cell_value and any(char.isdigit() for char in cell_value):
-                        # Para columnas con múltiples valores, tomar el primero
-                        first_value = cell_value.split(',')[0].strip()
-                        if first_value and first_value != '0':
-                            fixed_df.iloc[idx, col_idx] = first_value
-                            corrections_made += 1
+            for col_idx in range(n_cols):
+                cell_value = _as_text(col_idx)
+                
+                # Detectar patrones con comas y múltiples números (la búsqueda de dígitos
+                # y el corte solo se hacen sobre las celdas que tienen coma)
+                multi_mask = cell_value.str.contains(',', regex=False).to_numpy()
+                if not multi_mask.any():
+                    continue
+                with_comma = cell_value[multi_mask]
+                
+                # Para columnas con múltiples valores, tomar el primero
+                first_value = with_comma.str.split(',', n=1).str[0].str.strip()
+                keep = (with_comma.str.contains(self._RE_DIGIT) & ~first_value.isin(['', '0'])).to_numpy()
+                multi_mask[multi_mask] = keep
+                if keep.any():
+                    _assign(multi_mask, col_idx, first_value.to_numpy()[keep])
+                corrections_made += int(keep.sum())
             
             # Mostrar resultados
             if corrections_made > 0:
                 st.success(f"✅ {corrections_made} correcciones aplicadas")
-                st.write("**Ejemplos de corrección:**")
+                self._log("**Ejemplos de corrección:**")
                 
                 # Mostrar ejemplos de correcciones
                 examples_shown = 0
                 for idx in range(min(3, len(df))):
                     if str(df.iloc[idx, 0]) != str(fixed_df.iloc[idx, 0]):
-                        st.write(f"**Fila {idx+1} - Antes:** {df.iloc[idx, 0]}")
-                        st.write(f"**Fila {idx+1} - Después:** Col1='{fixed_df.iloc[idx, 0]}' | Col2='{fixed_df.iloc[idx, 1]}' | Col3='{fixed_df.iloc[idx, 2]}'")
+                        self._log(f"**Fila {idx+1} - Antes:** {df.iloc[idx, 0]}")
+                        self._log(f"**Fila {idx+1} - Después:** Col1='{fixed_df.iloc[idx, 0]}' | Col2='{fixed_df.iloc[idx, 1]}' | Col3='{fixed_df.iloc[idx, 2]}'")
                         examples_shown += 1
                         if examples_shown >= 2:
                             break
             else:
                 st.info("✅ No se encontraron columnas concatenadas para corregir")
             
-            # NUEVO: Limpiar filas incompletas después de las correcciones
-            fixed_df = self._remove_incomplete_rows(fixed_df)
-            
-            # NUEVO: Limpiar datos con saltos de línea y caracteres especiales
-            fixed_df = self._clean_special_characters(fixed_df)
-            
-            # NUEVO: Eliminar filas duplicadas
-            fixed_df = self._remove_duplicate_rows(fixed_df)
-            
-            # NUEVO: Corregir patrones específicos problemáticos
-            fixed_df = self._fix_specific_problematic_patterns(fixed_df)
-            
-            # NUEVO: Expandir columnas para páginas con menos columnas
-            fixed_df = self._expand_columns_for_short_pages(fixed_df)
-            
-            return fixed_df
+            # Los pasos siguientes reciben fixed_df en propiedad (ya es una copia), así que no
+            # lo vuelven a copiar: cada uno devuelve un DataFrame nuevo o prepara sus cambios
+            # aparte y los aplica al final, de modo que si falla devuelve su entrada intacta
+            return (
+                fixed_df
+                .pipe(self._remove_incomplete_rows)            # NUEVO: Limpiar filas incompletas después de las correcciones
+                .pipe(self._clean_special_characters)          # NUEVO: Limpiar datos con saltos de línea y caracteres especiales
+                .pipe(self._remove_duplicate_rows)             # NUEVO: Eliminar filas duplicadas
+                .pipe(self._fix_specific_problematic_patterns) # NUEVO: Corregir patrones específicos problemáticos
+                .pipe(self._expand_columns_for_short_pages)    # NUEVO: Expandir columnas para páginas con menos columnas
+            )
             
         except Exception as e:
             st.warning(f"⚠️ Error corrigiendo columnas: {str(e)}")
@@ -1370,25 +1621,24 @@ class TablillasExtractorPro:
             
             st.info("🧹 Limpiando filas incompletas...")
             
-            valid_rows = []
-            removed_count = 0
+            # Verificar qué filas son válidas
+            valid_mask = self._valid_fl_row_mask(df)
+            removed_count = int((~valid_mask).sum())
             
-            for idx in df.index:
-                row = df.iloc[idx]
-                
-                # Verificar si la fila es válida
-                if self._is_valid_fl_row(row):
-                    valid_rows.append(idx)
-                else:
-                    removed_count += 1
-                    first_col = str(row.iloc[0]).strip()
-                    st.write(f"🗑️ Fila incompleta removida: {first_col}")
+            for first_col in df.iloc[~valid_mask, 0].astype(str).str.strip():
+                self._log(f"🗑️ Fila incompleta removida: {first_col}")
             
             if removed_count > 0:
                 st.success(f"✅ {removed_count} filas incompletas removidas")
             
-            if valid_rows:
-                return df.loc[valid_rows].reset_index(drop=True)
+            if valid_mask.all() and df.index.equals(pd.RangeIndex(len(df))):
+                # Nada que quitar: el DataFrame ya tiene el índice 0..n-1, no hace falta copiarlo
+                return df
+            elif valid_mask.any():
+                # Una sola copia al filtrar; el índice nuevo se asigna sin volver a copiar los datos
+                kept_df = df.take(np.flatnonzero(valid_mask))
+                kept_df.index = pd.RangeIndex(len(kept_df))
+                return kept_df
             else:
                 st.warning("⚠️ No quedaron filas válidas después de la limpieza")
                 return pd.DataFrame()
@@ -1397,42 +1647,67 @@ class TablillasExtractorPro:
             st.warning(f"⚠️ Error limpiando filas: {str(e)}")
             return df
     
+    @staticmethod
+    def _staged_column(df: pd.DataFrame, staged: Dict[int, np.ndarray], col_idx: int) -> np.ndarray:
+        """Copia object de una columna donde un paso escribe sin tocar df hasta terminar"""
+        if col_idx not in staged:
+            staged[col_idx] = df.iloc[:, col_idx].to_numpy(dtype=object, copy=True)
+        return staged[col_idx]
+    
+    @staticmethod
+    def _apply_staged_columns(df: pd.DataFrame, staged: Dict[int, np.ndarray]) -> pd.DataFrame:
+        """Sustituir de una vez las columnas preparadas: si el paso falla antes, df queda intacto"""
+        for col_idx, values in staged.items():
+            df.isetitem(col_idx, values)
+        return df
+    
     def _clean_special_characters(self, df: pd.DataFrame) -> pd.DataFrame:
         """Limpiar caracteres especiales, saltos de línea y datos mal formateados"""
         try:
             st.info("🧹 Limpiando caracteres especiales y saltos de línea...")
             
-            cleaned_df = df.copy()
+            # Las correcciones se preparan aparte y se aplican al final (ver _fix_concatenated_columns)
+            cleaned_df = df
+            staged = {}
             corrections_made = 0
             
-            for idx in cleaned_df.index:
-                for col_idx in range(len(cleaned_df.columns)):
-                    cell_value = str(cleaned_df.iloc[idx, col_idx]).strip()
-                    
-                    # Limpiar saltos de línea y caracteres especiales
-                    if '\n' in cell_value or '\r' in cell_value:
-                        # Reemplazar saltos de línea con espacios
-                        cleaned_value = cell_value.replace('\n', ' ').replace('\r', ' ')
-                        # Limpiar espacios múltiples
-                        cleaned_value = ' '.join(cleaned_value.split())
-                        cleaned_df.iloc[idx, col_idx] = cleaned_value
-                        corrections_made += 1
-                    
-                    # Limpiar comillas dobles al inicio y final
-                    if cell_value.startswith('"') and cell_value.endswith('"'):
-                        cleaned_value = cell_value[1:-1].strip()
-                        cleaned_df.iloc[idx, col_idx] = cleaned_value
-                        corrections_made += 1
-                    
-                    # Limpiar valores que contienen solo espacios o caracteres especiales
-                    if cell_value in ['', ' ', 'nan', 'None', 'null']:
-                        cleaned_df.iloc[idx, col_idx] = ''
-                        corrections_made += 1
+            for col_idx in range(len(cleaned_df.columns)):
+                # Enteros, booleanos y fechas nunca producen saltos de línea, comillas ni
+                # textos vacíos al convertirse a str: no hace falta recorrerlos
+                if cleaned_df.dtypes.iloc[col_idx].kind in 'iubM':
+                    continue
+                
+                cell_value = cleaned_df.iloc[:, col_idx].astype(str).str.strip()
+                cleaned_value = pd.Series(np.nan, index=cell_value.index, dtype=object)
+                # Las máscaras se calculan sobre cadenas Arrow; las correcciones (pocas celdas)
+                # siguen usando str de Python
+                scan_text = cell_value.astype(TEXT_SCAN_DTYPE)
+                
+                # Limpiar saltos de línea y caracteres especiales
+                # (reemplazar saltos de línea con espacios y limpiar espacios múltiples)
+                line_break_mask = (scan_text.str.contains('\n', regex=False)
+                                   | scan_text.str.contains('\r', regex=False)).to_numpy(dtype=bool)
+                if line_break_mask.any():
+                    cleaned_value[line_break_mask] = cell_value[line_break_mask].str.split().str.join(' ')
+                
+                # Limpiar comillas dobles al inicio y final
+                quoted_mask = (scan_text.str.startswith('"') & scan_text.str.endswith('"')).to_numpy(dtype=bool)
+                if quoted_mask.any():
+                    cleaned_value[quoted_mask] = cell_value[quoted_mask].str[1:-1].str.strip()
+                
+                # Limpiar valores que contienen solo espacios o caracteres especiales
+                empty_mask = scan_text.isin(['', ' ', 'nan', 'None', 'null']).to_numpy(dtype=bool)
+                cleaned_value[empty_mask] = ''
+                
+                changed = line_break_mask | quoted_mask | empty_mask
+                if changed.any():
+                    self._staged_column(cleaned_df, staged, col_idx)[changed] = cleaned_value.to_numpy()[changed]
+                corrections_made += int(line_break_mask.sum() + quoted_mask.sum() + empty_mask.sum())
             
             if corrections_made > 0:
                 st.success(f"✅ {corrections_made} celdas limpiadas de caracteres especiales")
             
-            return cleaned_df
+            return self._apply_staged_columns(cleaned_df, staged)
             
         except Exception as e:
             st.warning(f"⚠️ Error limpiando caracteres especiales: {str(e)}")
@@ -1446,20 +1721,16 @@ class TablillasExtractorPro:
             if df.empty:
                 return df
             
-            # Crear una columna temporal para identificar duplicados
             # Usar Return_Packing_Slip como identificador único
             if len(df.columns) > 2:
-                # Usar la tercera columna como Return_Packing_Slip
-                df['_temp_id'] = df.iloc[:, 2].astype(str)
+                # Usar la tercera columna como Return_Packing_Slip (sin escribir columnas temporales)
+                slip_ids = df.iloc[:, 2].astype(str)
                 
                 # Contar duplicados antes de eliminar
                 duplicates_before = len(df)
-                df_unique = df.drop_duplicates(subset=['_temp_id'], keep='first')
+                df_unique = df.take(np.flatnonzero(~slip_ids.duplicated(keep='first').to_numpy()))
                 duplicates_removed = duplicates_before - len(df_unique)
                 
-                # Eliminar columna temporal
-                df_unique = df_unique.drop('_temp_id', axis=1)
-                
                 if duplicates_removed > 0:
                     st.success(f"✅ {duplicates_removed} filas duplicadas eliminadas")
                 else:
@@ -1479,63 +1750,63 @@ class TablillasExtractorPro:
         try:
             st.info("🔧 Corrigiendo patrones específicos problemáticos...")
             
-            fixed_df = df.copy()
+            # Las correcciones se preparan aparte y se aplican al final (ver _fix_concatenated_columns)
+            fixed_df = df
+            staged = {}
             corrections_made = 0
+            n_cols = len(fixed_df.columns)
+            corrected = np.zeros(len(fixed_df), dtype=bool)
             
-            for idx in fixed_df.index:
-                first_col = str(fixed_df.iloc[idx, 0]).strip()
+            # Patrón problemático: "FL\n61D\n729000018785\n9/23/2025"
+            if n_cols:
+                first_col = fixed_df.iloc[:, 0].astype(str).str.strip()
+                problematic = (first_col.str.startswith('"FL') & first_col.str.contains('\n', regex=False)).to_numpy()
                 
-                # Patrón problemático: "FL\n61D\n729000018785\n9/23/2025"
-                if first_col.startswith('"FL') and '\n' in first_col:
-                    # Extraer componentes del patrón problemático
-                    import re
-                    
-                    # Limpiar comillas y saltos de línea
-                    clean_content = first_col.replace('"', '').replace('\n', ' ').strip()
-                    parts = clean_content.split()
+                if problematic.any():
+                    # Limpiar comillas y saltos de línea y extraer componentes
+                    parts = (first_col[problematic]
+                             .str.replace('"', '', regex=False)
+                             .str.replace('\n', ' ', regex=False)
+                             .str.split(expand=True))
                     
-                    if len(parts) >= 4:
-                        # Reorganizar: FL, WH_Code, Return_Packing_Slip, Return_Date
-                        fixed_df.iloc[idx, 0] = parts[0]  # "FL"
+                    if parts.shape[1] >= 4:
+                        complete = parts[3].notna().to_numpy()
+                        positions = np.flatnonzero(problematic)[complete]
+                        parts = parts[complete]
                         
-                        if len(fixed_df.columns) > 1:
-                            fixed_df.iloc[idx, 1] = parts[1]  # WH_Code
-                        
-                        if len(fixed_df.columns) > 2:
-                            fixed_df.iloc[idx, 2] = parts[2]  # Return_Packing_Slip
+                        # Reorganizar: FL, WH_Code, Return_Packing_Slip, Return_Date
+                        for col_idx in range(min(3, n_cols)):
+                            self._staged_column(fixed_df, staged, col_idx)[positions] = parts[col_idx].to_numpy()
                         
-                        if len(fixed_df.columns) > 3:
-                            # Convertir fecha al formato correcto
+                        if n_cols > 3:
+                            # Convertir fecha al formato correcto (se conserva el texto si no es m/d/Y)
                             date_str = parts[3]
-                            try:
-                                from datetime import datetime
-                                if '/' in date_str:
-                                    date_obj = datetime.strptime(date_str, '%m/%d/%Y')
-                                    fixed_df.iloc[idx, 3] = date_obj.strftime('%Y-%m-%d %H:%M:%S')
-                                else:
-                                    fixed_df.iloc[idx, 3] = date_str
-                            except:
-                                fixed_df.iloc[idx, 3] = date_str
+                            date_obj = pd.to_datetime(date_str, format='%m/%d/%Y', errors='coerce')
+                            convertible = date_str.str.contains('/', regex=False) & date_obj.notna()
+                            self._staged_column(fixed_df, staged, 3)[positions] = (
+                                date_obj.dt.strftime('%Y-%m-%d %H:%M:%S').where(convertible, date_str).to_numpy()
+                            )
                         
-                        corrections_made += 1
-                        continue
+                        corrected[positions] = True
+                        corrections_made += len(positions)
+            
+            # Patrón problemático: datos con saltos de línea en Customer_Name
+            for col_idx in range(5, min(10, n_cols)):  # Revisar columnas de texto
+                cell_values = fixed_df.iloc[:, col_idx].astype(str).str.strip()
+                multiline = (cell_values.str.count('\n') >= 2).to_numpy() & ~corrected
                 
-                # Patrón problemático: datos con saltos de línea en Customer_Name
-                for col_idx in range(5, min(10, len(fixed_df.columns))):  # Revisar columnas de texto
-                    cell_value = str(fixed_df.iloc[idx, col_idx]).strip()
-                    
-                    if '\n' in cell_value and len(cell_value.split('\n')) > 2:
-                        # Limpiar saltos de línea y tomar solo la primera línea
-                        first_line = cell_value.split('\n')[0].strip()
-                        fixed_df.iloc[idx, col_idx] = first_line
-                        corrections_made += 1
+                if multiline.any():
+                    # Limpiar saltos de línea y tomar solo la primera línea
+                    first_line = cell_values[multiline].str.split('\n').str[0].str.strip()
+                    self._staged_column(fixed_df, staged, col_idx)[multiline] = first_line.to_numpy()
+                    corrections_made += int(multiline.sum())
             
             if corrections_made > 0:
                 st.success(f"✅ {corrections_made} patrones problemáticos corregidos")
             else:
                 st.info("✅ No se encontraron patrones problemáticos específicos")
             
-            return fixed_df
+            return self._apply_staged_columns(fixed_df, staged)
             
         except Exception as e:
             st.warning(f"⚠️ Error corrigiendo patrones específicos: {str(e)}")
@@ -1553,59 +1824,53 @@ class TablillasExtractorPro:
             if len(df.columns) < 15:
                 st.info(f"📋 Tabla detectada con {len(df.columns)} columnas - expandiendo...")
                 
-                expanded_df = df.copy()
+                # Las partes se escriben en columnas preparadas aparte y se aplican al final
+                # (ver _fix_concatenated_columns)
+                expanded_df = df
+                staged = {}
+                n_cols = len(expanded_df.columns)
                 corrections_made = 0
                 
-                for idx in expanded_df.index:
+                def _write_parts(parts: pd.DataFrame, col_idx: int) -> int:
+                    """Escribe la parte i de cada fila en la columna col_idx + i; devuelve las partes extra escritas"""
+                    extra = 0
+                    for i in parts.columns:
+                        if col_idx + i >= n_cols:
+                            break
+                        part = parts[i].dropna()
+                        if len(part):
+                            self._staged_column(expanded_df, staged, col_idx + i)[part.index.to_numpy()] = part.to_numpy()
+                            if i:
+                                extra += len(part)
+                    return extra
+                
+                # Columna por columna: cada fila solo escribe hacia la derecha, así que
+                # procesar las columnas en orden equivale a recorrer cada fila celda por celda
+                for col_idx in range(min(5, n_cols)):
                     # Buscar patrones de datos concatenados en las primeras columnas
-                    for col_idx in range(min(5, len(expanded_df.columns))):
-                        cell_value = str(expanded_df.iloc[idx, col_idx]).strip()
-                        
-                        # Patrón: datos separados por comas o espacios múltiples
-                        if ',' in cell_value and len(cell_value.split(',')) > 1:
-                            parts = [part.strip() for part in cell_value.split(',')]
-                            
-                            # Si encontramos datos separados por comas, expandir
-                            if len(parts) >= 2:
-                                # Reemplazar el valor original con la primera parte
-                                expanded_df.iloc[idx, col_idx] = parts[0]
-                                
-                                # Agregar las partes restantes en columnas siguientes
-                                for i, part in enumerate(parts[1:], 1):
-                                    if col_idx + i < len(expanded_df.columns):
-                                        expanded_df.iloc[idx, col_idx + i] = part
-                                        corrections_made += 1
-                                
-                                continue
-                        
-                        # Patrón: datos con espacios múltiples (como "226, 1499")
-                        if ' ' in cell_value and len(cell_value.split()) > 1:
-                            parts = cell_value.split()
-                            
-                            # Verificar si parece ser datos numéricos separados
-                            numeric_parts = []
-                            for part in parts:
-                                # Limpiar comas y verificar si es numérico
-                                clean_part = part.replace(',', '').strip()
-                                if clean_part.isdigit() or (clean_part.endswith('M') and clean_part[:-1].isdigit()):
-                                    numeric_parts.append(clean_part)
-                            
-                            if len(numeric_parts) >= 2:
-                                # Reemplazar con la primera parte
-                                expanded_df.iloc[idx, col_idx] = numeric_parts[0]
-                                
-                                # Agregar las partes restantes
-                                for i, part in enumerate(numeric_parts[1:], 1):
-                                    if col_idx + i < len(expanded_df.columns):
-                                        expanded_df.iloc[idx, col_idx + i] = part
-                                        corrections_made += 1
+                    # Se lee la columna con lo que ya le escribieron las columnas anteriores
+                    column = staged[col_idx] if col_idx in staged else expanded_df.iloc[:, col_idx]
+                    cell_values = pd.Series(column).astype(str).str.strip().reset_index(drop=True)
+                    
+                    # Patrón: datos separados por comas
+                    has_comma = cell_values.str.contains(',', regex=False)
+                    if has_comma.any():
+                        parts = cell_values[has_comma].str.split(',', expand=True).apply(lambda part: part.str.strip())
+                        corrections_made += _write_parts(parts, col_idx)
+                    
+                    # Patrón: datos numéricos separados por espacios (como "226 1499M")
+                    has_space = cell_values.str.contains(' ', regex=False) & ~has_comma
+                    if has_space.any():
+                        numeric_parts = cell_values[has_space].str.extractall(self._RE_NUMERIC_TOKEN)[0].unstack()
+                        numeric_parts = numeric_parts[numeric_parts.count(axis=1) >= 2]
+                        corrections_made += _write_parts(numeric_parts, col_idx)
                 
                 if corrections_made > 0:
                     st.success(f"✅ {corrections_made} columnas expandidas para páginas cortas")
                 else:
                     st.info("✅ No se encontraron patrones para expandir")
                 
-                return expanded_df
+                return self._apply_staged_columns(expanded_df, staged)
             else:
                 st.info("✅ Tabla ya tiene suficientes columnas")
                 return df
@@ -1623,17 +1888,17 @@ class TablillasExtractorPro:
                 
                 # Mostrar diferencias
                 if len(current_columns) != len(ref_columns):
-                    st.write(f"  📊 **Página {page_num}**: {len(current_columns)} columnas vs {len(ref_columns)} de referencia")
+                    self._log(f"  📊 **Página {page_num}**: {len(current_columns)} columnas vs {len(ref_columns)} de referencia")
                     
                     # Mostrar primeras columnas para comparar
-                    st.write(f"  🔍 **Primeras 5 columnas de Página {page_num}:**")
+                    self._log(f"  🔍 **Primeras 5 columnas de Página {page_num}:**")
                     for j, col in enumerate(current_columns[:5]):
-                        st.write(f"    {j+1}. {col}")
+                        self._log(f"    {j+1}. {col}")
                     
                     if len(current_columns) < len(ref_columns):
-                        st.write(f"  ⚠️ **Página {page_num} tiene {len(ref_columns) - len(current_columns)} columnas menos**")
+                        self._log(f"  ⚠️ **Página {page_num} tiene {len(ref_columns) - len(current_columns)} columnas menos**")
                     else:
-                        st.write(f"  ℹ️ **Página {page_num} tiene {len(current_columns) - len(ref_columns)} columnas más**")
+                        self._log(f"  ℹ️ **Página {page_num} tiene {len(current_columns) - len(ref_columns)} columnas más**")
                         
         except Exception as e:
             st.warning(f"⚠️ Error analizando diferencias de columnas: {str(e)}")
@@ -1646,12 +1911,10 @@ class TablillasExtractorPro:
         
         try:
             total_rows = len(df)
-            slip_count = 0
-            
-            for idx in df.index:
-                row_text = ' '.join(str(cell) for cell in df.iloc[idx].values if pd.notna(cell))
-                if '729000018' in row_text:
-                    slip_count += 1
+            has_slip = np.zeros(total_rows, dtype=bool)
+            for col_idx in range(len(df.columns)):
+                has_slip |= df.iloc[:, col_idx].astype(str).str.contains('729000018', regex=False).to_numpy()
+            slip_count = int(has_slip.sum())
             
             st.info(f"📊 Filas extraídas: {total_rows}")
             st.info(f"📊 Slips encontrados: {slip_count}")
@@ -1659,17 +1922,11 @@ class TablillasExtractorPro:
             # Calcular totales si es posible
             if len(df.columns) > 15:
                 try:
-                    total_13 = 0
-                    total_15 = 0
-                    
-                    for idx in df.index:
-                        val_13 = str(df.iloc[idx, 13])
-                        val_15 = str(df.iloc[idx, 15])
-                        
-                        if val_13.isdigit():
-                            total_13 += int(val_13)
-                        if val_15.isdigit():
-                            total_15 += int(val_15)
+                    # Solo cuentan las celdas que son enteros sin signo escritos como texto
+                    text_13 = df.iloc[:, 13].astype(str)
+                    text_15 = df.iloc[:, 15].astype(str)
+                    total_13 = int(pd.to_numeric(text_13.where(text_13.str.isdigit()), errors='coerce').sum())
+                    total_15 = int(pd.to_numeric(text_15.where(text_15.str.isdigit()), errors='coerce').sum())
                     
                     st.success(f"📊 Totales calculados: Columna 13 = {total_13}, Columna 15 = {total_15}")
                     
@@ -1685,14 +1942,10 @@ class TablillasExtractorPro:
         
         try:
             # Obtener todo el texto de la página
-            full_text = ""
-            for row in df.values:
-                for cell in row:
-                    if pd.notna(cell):
-                        full_text += str(cell) + " "
-            
-            full_text = full_text.strip()
-            st.write(f"🔍 Texto completo encontrado: {full_text[:100]}...")
+            full_text = ' '.join(
+                str(cell) for row in df.itertuples(index=False, name=None) for cell in row if pd.notna(cell)
+            ).strip()
+            self._log(f"🔍 Texto completo encontrado: {full_text[:100]}...")
             
             # Verificar si contiene datos válidos
             if '729000018' in full_text and 'FL' in full_text:
@@ -1713,41 +1966,26 @@ class TablillasExtractorPro:
     def _parse_single_row_manually(self, text: str):
         """Parsea manualmente una fila cuando Camelot falla - DEL EXTRACTOR PRO"""
         try:
-            import re
-            
             # Crear una fila fake de pandas con los datos distribuidos
             # Buscar patrones específicos en el texto
             
             # 1. Return slip number
-            slip_match = re.search(r'(729000018\d{3})', text)
+            slip_match = self._RE_SLIP.search(text)
             slip_num = slip_match.group(1) if slip_match else ''
             
             # 2. Fechas
-            dates = re.findall(r'(\d{1,2}/\d{1,2}/\d{4})', text)
+            dates = self._RE_DATE.findall(text)
             
             # 3. Jobsite y Cost center
-            jobsite_match = re.search(r'(4\d{7})', text)
+            jobsite_match = self._RE_JOBSITE.search(text)
             jobsite = jobsite_match.group(1) if jobsite_match else ''
             
-            cost_match = re.search(r'(FL\d{3})', text)
+            cost_match = self._RE_COST_CENTER.search(text)
             cost_center = cost_match.group(1) if cost_match else ''
             
             # 4. Customer name (buscar patrones conocidos)
-            customer = ''
-            customer_patterns = [
-                r'(Phorcys Builders Corp)',
-                r'(Laz Construction)', 
-                r'(Pedreiras Construction[^0-9]*)',
-                r'(JGR Construction)',
-                r'(Caribbean Building Corp)',
-                r'(Thales Builders Corp)'
-            ]
-            
-            for pattern in customer_patterns:
-                match = re.search(pattern, text, re.IGNORECASE)
-                if match:
-                    customer = match.group(1)
-                    break
+            customer_match = self._RE_KNOWN_CUSTOMER.match(text)
+            customer = customer_match.group(customer_match.lastindex) if customer_match else ''
             
             # 5. Job name (después del customer)
             job_name = ''
@@ -1758,15 +1996,15 @@ class TablillasExtractorPro:
                     job_name = job_match.group(1).strip()
             
             # 6. Tablets y totales (buscar números y códigos)
-            tablets_match = re.search(r'(\d+,\s*\d+)', text)
+            tablets_match = self._RE_TABLETS.search(text)
             tablets = tablets_match.group(1) if tablets_match else ''
             
             # Buscar códigos como 226M, 1499M
-            codes_match = re.search(r'(\d+M,?\s*\d+M)', text)
+            codes_match = self._RE_OPEN_CODES.search(text)
             open_codes = codes_match.group(1) if codes_match else ''
             
             # Buscar números finales (delays)
-            final_numbers = re.findall(r'\b(\d{1,2})\b', text[-50:])  # Últimos 50 caracteres
+            final_numbers = self._RE_SHORT_NUMBER.findall(text[-50:])  # Últimos 50 caracteres
             
             # Crear una fila estructurada manualmente
             manual_row_data = [
@@ -1793,7 +2031,7 @@ class TablillasExtractorPro:
             # Crear DataFrame de una sola fila
             manual_df = pd.DataFrame([manual_row_data])
             
-            st.write(f"📝 Fila manual creada: Slip={slip_num}, Customer={customer[:20]}, Tablets={tablets}")
+            self._log(f"📝 Fila manual creada: Slip={slip_num}, Customer={customer[:20]}, Tablets={tablets}")
             
             return manual_df
             
@@ -1812,17 +2050,8 @@ class TablillasExtractorPro:
             
             # 1. Conteos básicos
             total_rows = len(df)
-            slip_count = 0
-            valid_slips = []
-            
-            import re
-            for idx in df.index:
-                row_text = ' '.join(str(cell) for cell in df.iloc[idx].values if pd.notna(cell))
-                if '729000018' in row_text:
-                    slip_match = re.search(r'(729000018\d{3})', row_text)
-                    if slip_match:
-                        slip_count += 1
-                        valid_slips.append(slip_match.group(1))
+            valid_slips = self._first_slip_per_row(df).dropna().tolist()
+            slip_count = len(valid_slips)
             
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -1888,55 +2117,66 @@ class TablillasExtractorPro:
         except Exception as e:
             st.error(f"Error en validación robusta: {e}")
     
+    def _first_slip_per_row(self, df: pd.DataFrame) -> pd.Series:
+        """Primer Return slip de cada fila (recorriendo columnas en orden), NaN si no hay"""
+        # El patrón no admite espacios, así que buscar celda por celda equivale a buscar en la fila unida
+        slips = pd.concat(
+            [df.iloc[:, col_idx].astype(str).str.extract(self._RE_SLIP, expand=False)
+             for col_idx in range(len(df.columns))],
+            axis=1
+        )
+        return slips.bfill(axis=1).iloc[:, 0]
+    
     def _calculate_robust_totals(self, df: pd.DataFrame):
         """Calcula totales de manera robusta verificando múltiples columnas - DEL EXTRACTOR PRO"""
-        total_13 = 0
-        total_15 = 0
         valid_counts = {'col_13': 0, 'col_15': 0}
         
         # Buscar totales en las columnas esperadas y alternativas
-        for idx in df.index:
-            # Para columna 13 (Total)
-            found_13 = False
-            for col_idx in [13, 12, 14]:  # Columnas probables
-                if col_idx < len(df.columns):
-                    val = str(df.iloc[idx, col_idx])
-                    if val.isdigit() and 1 <= int(val) <= 20:  # Rango típico
-                        total_13 += int(val)
-                        valid_counts['col_13'] += 1
-                        found_13 = True
-                        break
-            
-            # Para columna 15 (Tablets Total)  
-            found_15 = False
-            for col_idx in [15, 14, 16]:  # Columnas probables
-                if col_idx < len(df.columns):
-                    val = str(df.iloc[idx, col_idx])
-                    if val.isdigit() and 1 <= int(val) <= 20:  # Rango típico
-                        total_15 += int(val)
-                        valid_counts['col_15'] += 1
-                        found_15 = True
-                        break
+        # Para columna 13 (Total)
+        total_13, valid_counts['col_13'] = self._sum_first_valid_counts(df, [13, 12, 14])  # Columnas probables
+        
+        # Para columna 15 (Tablets Total)
+        total_15, valid_counts['col_15'] = self._sum_first_valid_counts(df, [15, 14, 16])  # Columnas probables
         
         return total_13, total_15, valid_counts
     
+    def _sum_first_valid_counts(self, df: pd.DataFrame, candidate_columns: List[int]) -> Tuple[int, int]:
+        """Suma, por fila, el primer valor entero entre 1 y 20 de las columnas candidatas (en orden)"""
+        picked = np.full(len(df), np.nan)
+        for col_idx in candidate_columns:
+            if col_idx >= len(df.columns):
+                continue
+            column = df.iloc[:, col_idx]
+            if isinstance(column.dtype, np.dtype) and column.dtype.kind in 'iu':
+                # Enteros ya numéricos: sin pasar por texto (los negativos quedan fuera del rango)
+                values = column.to_numpy(dtype=float)
+            elif column.dtype.kind in 'fbcmM':
+                # El texto de flotantes, booleanos o fechas nunca es solo dígitos
+                continue
+            else:
+                text = column.astype(str)
+                values = pd.to_numeric(text.where(text.str.isdigit()), errors='coerce').to_numpy(dtype=float)
+            # Rango típico; solo rellena las filas sin valor en una columna anterior
+            picked = np.where(np.isnan(picked) & (values >= 1) & (values <= 20), values, picked)
+        return int(np.nansum(picked)), int(np.count_nonzero(~np.isnan(picked)))
+    
     def _extract_pdf_totals_from_text(self, df: pd.DataFrame):
         """Extrae los totales finales del PDF desde el propio DataFrame - DEL EXTRACTOR PRO"""
         result = {'found': False, 'total_13': 0, 'total_15': 0}
         
         try:
-            import re
-            
-            # Buscar en las últimas filas números que podrían ser totales
-            last_rows_text = ""
-            for idx in df.tail(5).index:  # Últimas 5 filas
-                row_text = ' '.join(str(cell) for cell in df.iloc[idx].values if pd.notna(cell))
-                last_rows_text += row_text + " "
-            
-            # Buscar patrón de totales (dos números grandes al final)
-            # Patrón: número de 2-3 dígitos seguido de otro número de 2-3 dígitos
-            total_pattern = r'\b(\d{2,3})\s+(\d{2,3})\b'
-            matches = re.findall(total_pattern, last_rows_text)
+            # Los totales suelen estar en la última fila: basta con ella si tiene un par de
+            # números y no empieza por un número que pudiera emparejarse con la fila anterior
+            # (stack recorre fila por fila y descarta las celdas vacías)
+            last_row_text = ' '.join(map(str, df.tail(1).stack()))
+            matches = self._RE_PDF_TOTALS.findall(last_row_text)
+            
+            if not matches or self._RE_LEADING_NUMBER.match(last_row_text):
+                # Buscar en las últimas filas números que podrían ser totales
+                last_rows_text = ' '.join(map(str, df.tail(5).stack()))  # Últimas 5 filas
+                
+                # Buscar patrón de totales (dos números grandes al final)
+                matches = self._RE_PDF_TOTALS.findall(last_rows_text)
             
             if matches:
                 # Tomar el último match como los totales finales
@@ -1979,6 +2219,11 @@ class TablillasExtractorPro:
             # Calcular métricas avanzadas
             df = self._calculate_advanced_metrics(df)
             
+            # Columnas de baja cardinalidad como category: igualdad y groupby sobre códigos enteros
+            for col in ['Priority_Level', 'WH', 'WH_Code', 'Cost_Center']:
+                if col in df.columns:
+                    df[col] = df[col].astype('category')
+            
             st.success(f"✅ Datos procesados correctamente: {len(df)} registros válidos")
             
             # NUEVO: Mostrar resumen de mejoras aplicadas
@@ -1997,7 +2242,13 @@ class TablillasExtractorPro:
             
             # Estadísticas básicas
             total_rows = len(df)
-            fl_rows = len(df[df.iloc[:, 0].astype(str).str.contains('FL', na=False)])
+            first_col = df.iloc[:, 0]
+            if isinstance(first_col.dtype, pd.CategoricalDtype):
+                # Evaluar cada categoría una sola vez; el código -1 (vacío) cae en el False final
+                has_fl = np.append(first_col.cat.categories.astype(str).str.contains('FL', regex=False), False)
+                fl_rows = int(has_fl[first_col.cat.codes.to_numpy()].sum())
+            else:
+                fl_rows = int(first_col.astype(str).str.contains('FL', regex=False).sum())
             success_rate = (fl_rows / total_rows * 100) if total_rows > 0 else 0
             
             col1, col2, col3, col4 = st.columns(4)
@@ -2049,14 +2300,24 @@ class TablillasExtractorPro:
         except Exception as e:
             st.warning(f"⚠️ Error mostrando resumen: {str(e)}")
     
+    def _known_date_format(self, values: pd.Series) -> Optional[str]:
+        """Formato de fecha del PDF si la primera fecha lo cumple (misma base que la inferencia de pandas)"""
+        non_null = values.dropna()
+        if len(non_null) == 0 or not isinstance(non_null.iloc[0], str):
+            return None
+        first_date = pd.to_datetime(non_null.iloc[0], format=self._PDF_DATE_FORMAT, errors='coerce')
+        return self._PDF_DATE_FORMAT if pd.notna(first_date) else None
+    
     def _clean_data_types_advanced(self, df: pd.DataFrame) -> pd.DataFrame:
         """Limpieza avanzada de tipos de datos"""
         # Limpiar fechas con manejo robusto de errores
         date_columns = ['Return_Date', 'Invoice_Start_Date', 'Invoice_End_Date', 'Counted_Date']
         for col in date_columns:
             if col in df.columns:
-                # Convertir a datetime con manejo de errores
-                df[col] = pd.to_datetime(df[col], errors='coerce')
+                # Convertir a datetime con manejo de errores; con formato explícito si aplica
+                df[col] = pd.to_datetime(
+                    df[col], format=self._known_date_format(df[col]), errors='coerce', cache=True
+                )
         
         # Limpiar números con validación
         numeric_columns = ['Total_Tablets', 'Total_Open', 'Counting_Delay', 'Validation_Delay']
@@ -2065,15 +2326,22 @@ class TablillasExtractorPro:
                 # Convertir a numérico, rellenar NaN con 0
                 df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
         
-        # Limpiar strings
+        # Limpiar strings: clientes, obras y almacenes se repiten mucho, así que se limpian
+        # solo los valores distintos y se expanden por código (el albarán es único por fila)
         string_columns = ['Customer_Name', 'Job_Site_Name', 'WH_Code', 'Return_Packing_Slip']
         for col in string_columns:
             if col in df.columns:
-                df[col] = df[col].astype(str).str.strip()
+                if col == 'Return_Packing_Slip':
+                    df[col] = df[col].astype(str).str.strip()
+                    continue
+                codes, uniques = pd.factorize(df[col].astype(str))
+                cleaned = uniques.str.strip()
+                # NUEVO: Normalizar códigos de almacén a MAYÚSCULAS
+                if col == 'WH_Code':
+                    cleaned = cleaned.str.upper()
+                df[col] = cleaned.to_numpy()[codes]
         
-        # NUEVO: Normalizar códigos de almacén a MAYÚSCULAS
         if 'WH_Code' in df.columns:
-            df['WH_Code'] = df['WH_Code'].str.upper()
             st.info(f"🔧 Normalizados códigos de almacén a mayúsculas (ej: 612d → 612D)")
         
         return df
@@ -2095,36 +2363,35 @@ class TablillasExtractorPro:
                 try:
                     # Para albaranes cerrados (Total_Open = 0): usar Counted_Date - Return_Date
                     # Para albaranes abiertos (Total_Open > 0): usar current_date - Return_Date
-                    df['Days_Since_Return'] = 0
+                    # (todas las filas en una sola pasada; sin Total_Open se consideran cerradas)
+                    return_date = df['Return_Date']
+                    total_open = df['Total_Open'] if 'Total_Open' in df.columns else pd.Series(0, index=df.index)
+                    closed_mask = (total_open == 0).to_numpy()
+                    open_mask = (total_open > 0).to_numpy()
                     
-                    # Albaranes cerrados: usar Counted_Date si está disponible
-                    closed_mask = df.get('Total_Open', pd.Series([0])) == 0
-                    if 'Counted_Date' in df.columns:
-                        # Para albaranes cerrados con Counted_Date válida
-                        closed_with_counted = closed_mask & df['Counted_Date'].notna()
-                        df.loc[closed_with_counted, 'Days_Since_Return'] = (
-                            df.loc[closed_with_counted, 'Counted_Date'] - 
-                            df.loc[closed_with_counted, 'Return_Date']
-                        ).dt.days
-                        
-                        # Para albaranes cerrados sin Counted_Date, usar current_date
-                        closed_without_counted = closed_mask & df['Counted_Date'].isna()
-                        df.loc[closed_without_counted, 'Days_Since_Return'] = (
-                            current_date - df.loc[closed_without_counted, 'Return_Date']
-                        ).dt.days
-                    else:
-                        # Si no hay Counted_Date, usar current_date para cerrados
-                        df.loc[closed_mask, 'Days_Since_Return'] = (
-                            current_date - df.loc[closed_mask, 'Return_Date']
-                        ).dt.days
+                    # Abiertos y cerrados sin Counted_Date: días hasta hoy; el resto queda en 0
+                    days = np.where(
+                        closed_mask | open_mask,
+                        (current_date - return_date).dt.days.to_numpy(dtype=float),
+                        0.0
+                    )
                     
-                    # Albaranes abiertos: siempre usar current_date
-                    open_mask = df.get('Total_Open', pd.Series([0])) > 0
-                    df.loc[open_mask, 'Days_Since_Return'] = (
-                        current_date - df.loc[open_mask, 'Return_Date']
-                    ).dt.days
+                    # Albaranes cerrados con Counted_Date válida
+                    if 'Counted_Date' in df.columns:
+                        counted_date = df['Counted_Date']
+                        closed_with_counted = closed_mask & counted_date.notna().to_numpy()
+                        days = np.where(
+                            closed_with_counted,
+                            (counted_date - return_date).dt.days.to_numpy(dtype=float),
+                            days
+                        )
                     
-                    df['Days_Since_Return'] = df['Days_Since_Return'].fillna(0)
+                    # Sin fechas faltantes la columna queda entera, como antes
+                    missing_days = np.isnan(days)
+                    if missing_days.any():
+                        df['Days_Since_Return'] = np.where(missing_days, 0.0, days)
+                    else:
+                        df['Days_Since_Return'] = days.astype('int64')
                     
                 except Exception as e:
                     st.warning(f"⚠️ Error calculando días desde retorno: {str(e)}")
@@ -2134,10 +2401,11 @@ class TablillasExtractorPro:
             if 'Return_Packing_Slip' in df.columns:
                 try:
                     # Extraer números del albarán para determinar antigüedad
-                    df['Slip_Number'] = df['Return_Packing_Slip'].str.extract(r'(\d+)', expand=False).astype(float)
-                    max_slip = df['Slip_Number'].max()
+                    slip_numbers = df['Return_Packing_Slip'].str.extract(self._RE_FIRST_NUMBER, expand=False).astype(float)
+                    df['Slip_Number'] = slip_numbers
+                    max_slip = slip_numbers.max()
                     if pd.notna(max_slip) and max_slip > 0:
-                        df['Slip_Age_Rank'] = (max_slip - df['Slip_Number']) / max_slip * 100
+                        df['Slip_Age_Rank'] = (max_slip - slip_numbers) / max_slip * 100
                     else:
                         df['Slip_Age_Rank'] = 0
                 except Exception as e:
@@ -2153,71 +2421,46 @@ class TablillasExtractorPro:
                     df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
             
             # Score de prioridad mejorado - VERSIÓN ROBUSTA
-            # Calcular score basado en datos disponibles
-            score_components = []
-            weights = []
-            
-            # Días desde retorno (siempre disponible)
-            if 'Days_Since_Return' in df.columns:
-                days_score = pd.to_numeric(df['Days_Since_Return'], errors='coerce').fillna(0)
-                score_components.append(days_score)
-                weights.append(0.4)
-            
-            # Tablillas abiertas (siempre disponible)
-            if 'Total_Open' in df.columns:
-                open_score = pd.to_numeric(df['Total_Open'], errors='coerce').fillna(0)
-                score_components.append(open_score)
-                weights.append(0.3)
-            
-            # Delays (si están disponibles)
-            if 'Counting_Delay' in df.columns:
-                counting_score = pd.to_numeric(df['Counting_Delay'], errors='coerce').fillna(0)
-                score_components.append(counting_score)
-                weights.append(0.2)
-            
-            if 'Validation_Delay' in df.columns:
-                validation_score = pd.to_numeric(df['Validation_Delay'], errors='coerce').fillna(0)
-                score_components.append(validation_score)
-                weights.append(0.1)
-            
-            # Calcular score ponderado
-            if score_components:
-                df['Priority_Score'] = sum(comp * weight for comp, weight in zip(score_components, weights))
-            else:
-                # Fallback: usar solo días desde retorno
-                df['Priority_Score'] = pd.to_numeric(df.get('Days_Since_Return', pd.Series([0])), errors='coerce').fillna(0)
-            
-            # Asegurar que Priority_Score es numérico
-            df['Priority_Score'] = pd.to_numeric(df['Priority_Score'], errors='coerce').fillna(0)
-            
-            # Niveles de prioridad más granulares
-            try:
-                df['Priority_Level'] = pd.cut(
-                    df['Priority_Score'],
-                    bins=[0, 10, 20, 35, float('inf')],
-                    labels=['Baja', 'Media', 'Alta', 'Crítica'],
-                    right=False
-                ).astype(str)
-            except Exception as e:
-                st.warning(f"⚠️ Error asignando niveles de prioridad: {str(e)}")
-                df['Priority_Level'] = 'Baja'
-            
-            # Categoría de urgencia visual
-            try:
-                df['Urgency_Category'] = '⚪ SIN DATOS'
-                
-                # Condiciones para urgencia
-                urgent_mask = (df['Priority_Score'] >= 35) | (df['Days_Since_Return'] >= 30)
-                attention_mask = (df['Priority_Score'] >= 20) | (df['Days_Since_Return'] >= 15)
-                normal_mask = (df['Priority_Score'] >= 10) | (df['Days_Since_Return'] >= 7)
-                
-                df.loc[normal_mask, 'Urgency_Category'] = '🟢 NORMAL'
-                df.loc[attention_mask, 'Urgency_Category'] = '🟡 ATENCIÓN'
-                df.loc[urgent_mask, 'Urgency_Category'] = '🔴 URGENTE'
-                
-            except Exception as e:
-                st.warning(f"⚠️ Error asignando categorías de urgencia: {str(e)}")
-                df['Urgency_Category'] = '⚪ SIN DATOS'
+            # Días desde retorno, tablillas abiertas y delays existen siempre a esta altura:
+            # se convierten a una matriz float una sola vez (vacíos y texto cuentan como 0)
+            score_weights = {
+                'Days_Since_Return': 0.4,
+                'Total_Open': 0.3,
+                'Counting_Delay': 0.2,
+                'Validation_Delay': 0.1,
+            }
+            score_inputs = (df[list(score_weights)]
+                            .apply(pd.to_numeric, errors='coerce')
+                            .to_numpy(dtype=float, na_value=0.0))
+            
+            # Calcular score ponderado (acumulado en el mismo orden que antes para que los
+            # valores en los límites de cada nivel no cambien por redondeo)
+            priority_score = np.zeros(len(df))
+            for component, weight in zip(score_inputs.T, score_weights.values()):
+                priority_score += component * weight
+            df['Priority_Score'] = priority_score
+            
+            # A partir de aquí todo es vectorizado: cualquier fallo lo maneja el try/except general
+            
+            # Niveles de prioridad más granulares: tramos [0,10) [10,20) [20,35) [35,inf);
+            # fuera de rango (negativo, inf o NaN) queda 'nan' como hacía pd.cut(...).astype(str)
+            level_edges = np.array([0, 10, 20, 35, np.inf])
+            level_labels = np.array(['nan', 'Baja', 'Media', 'Alta', 'Crítica', 'nan'], dtype=object)
+            level_idx = np.searchsorted(level_edges, df['Priority_Score'].to_numpy(dtype=float), side='right')
+            df['Priority_Level'] = level_labels[level_idx]
+            
+            # Categoría de urgencia visual: la primera condición que se cumple gana
+            priority_score = df['Priority_Score'].to_numpy()
+            days_since_return = df['Days_Since_Return'].to_numpy()
+            df['Urgency_Category'] = np.select(
+                [
+                    (priority_score >= 35) | (days_since_return >= 30),
+                    (priority_score >= 20) | (days_since_return >= 15),
+                    (priority_score >= 10) | (days_since_return >= 7),
+                ],
+                ['🔴 URGENTE', '🟡 ATENCIÓN', '🟢 NORMAL'],
+                default='⚪ SIN DATOS'
+            ).astype(object)
             
             st.info(f"✅ Métricas calculadas correctamente. Priority_Score: min={df['Priority_Score'].min():.2f}, max={df['Priority_Score'].max():.2f}")
             return df
@@ -2234,6 +2477,9 @@ class TablillasExtractorPro:
             return df
 
 def main():
+    # CSS Profesional - se construye una vez y se reutiliza en cada rerun
+    st.markdown(get_app_css(), unsafe_allow_html=True)
+    
     # Inicializar session_state para evitar problemas de transparencia
     if 'pdf_excel_generated' not in st.session_state:
         st.session_state['pdf_excel_generated'] = False
@@ -2281,7 +2527,7 @@ def main():
     ''', unsafe_allow_html=True)
     
     # Verificar dependencias
-    if not CAMELOT_AVAILABLE:
+    if not camelot_available():
         st.markdown("""
         <div class="alert-high">
         <h3>❌ Camelot no está instalado</h3>
@@ -2336,10 +2582,12 @@ def show_pdf_processing_tab():
         🧠 **Método inteligente** que prueba múltiples estrategias y separa filas concatenadas
         """)
         
-        # Extraer datos
+        # Extraer datos (el mismo PDF subido de nuevo no repite la extracción con Camelot)
         start_time = time.time()
-        extractor = TablillasExtractorPro()
-        df = extractor.extract_from_pdf(uploaded_file)
+        # Hash sobre el búfer de la subida (sin copiarlo a un bytes); Camelot lee del mismo objeto
+        with uploaded_file.getbuffer() as pdf_buffer:
+            file_digest = hashlib.sha256(pdf_buffer).hexdigest()
+        df = extract_pdf_cached(file_digest, uploaded_file)
         end_time = time.time()
         
         processing_time = end_time - start_time
@@ -2363,6 +2611,26 @@ def show_pdf_processing_tab():
         else:
             show_extraction_error()
 
+def extract_pdf_cached(digest: str, uploaded_file) -> Optional[pd.DataFrame]:
+    """Extraer los datos de un PDF - reutiliza la última extracción correcta del mismo contenido"""
+    with _PDF_RESULTS_LOCK:
+        cached_df = _PDF_RESULTS_CACHE.get(digest)
+        if cached_df is not None:
+            _PDF_RESULTS_CACHE.move_to_end(digest)
+    if cached_df is not None:
+        st.info("♻️ Este PDF ya se procesó: se reutilizan los datos extraídos")
+        return cached_df.copy()
+    
+    extractor = TablillasExtractorPro()
+    df = extractor.extract_from_pdf(uploaded_file, digest)
+    
+    if df is not None and not df.empty:
+        with _PDF_RESULTS_LOCK:
+            _PDF_RESULTS_CACHE[digest] = df.copy()
+            while len(_PDF_RESULTS_CACHE) > PDF_CACHE_SIZE:
+                _PDF_RESULTS_CACHE.popitem(last=False)
+    return df
+
 def show_extraction_summary(df: pd.DataFrame):
     """Mostrar resumen de extracción"""
     col1, col2, col3, col4 = st.columns(4)
@@ -2386,7 +2654,7 @@ def show_extraction_summary(df: pd.DataFrame):
     
     with col4:
         if 'Priority_Level' in df.columns:
-            critical_items = len(df[df['Priority_Level'] == 'Crítica'])
+            critical_items = int(df['Priority_Level'].value_counts().get('Crítica', 0))
         else:
             critical_items = 0
         st.metric("🚨 Items Críticos", critical_items)
@@ -2419,9 +2687,22 @@ def show_main_data_table(df: pd.DataFrame):
         elif 'Total_Open' in df.columns:
             display_df = display_df.sort_values('Total_Open', ascending=False)
         
-        st.dataframe(display_df, use_container_width=True)
+        show_dataframe_preview(display_df)
     else:
+        show_dataframe_preview(df)
+
+def show_dataframe_preview(df: pd.DataFrame, max_rows: int = MAX_PREVIEW_ROWS):
+    """Mostrar solo las primeras filas; la tabla completa se envía al navegador solo si se pide"""
+    if len(df) <= max_rows:
         st.dataframe(df, use_container_width=True)
+        return
+    
+    # Un expander cerrado igual serializa su contenido, por eso se usa un checkbox
+    if st.checkbox(f"📋 Ver todos ({len(df)} filas)", key="show_all_rows"):
+        st.dataframe(df, use_container_width=True)
+    else:
+        st.dataframe(df.head(max_rows), use_container_width=True)
+        st.caption(f"Mostrando {max_rows} de {len(df)} filas")
 
 def generate_daily_excel(df: pd.DataFrame):
     """Generar Excel diario automático"""
@@ -2496,7 +2777,7 @@ def create_comprehensive_excel(df: pd.DataFrame) -> bytes:
     output = io.BytesIO()
     
     try:
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs=XLSX_WRITER_KWARGS) as writer:
             # Hoja 1: Datos completos
             df.to_excel(writer, sheet_name='Datos_Completos', index=False)
             
@@ -2508,7 +2789,7 @@ def create_comprehensive_excel(df: pd.DataFrame) -> bytes:
             
             # Hoja 3: Resumen por almacén
             if 'WH_Code' in df.columns:
-                wh_summary = df.groupby('WH_Code').agg({
+                wh_summary = df.groupby('WH_Code', observed=True).agg({
                     'Total_Open': 'sum',
                     'Total_Tablets': 'sum',
                     'Counting_Delay': 'mean',
@@ -2523,8 +2804,14 @@ def create_comprehensive_excel(df: pd.DataFrame) -> bytes:
             # Calcular métricas de forma segura
             total_open = pd.to_numeric(df.get('Total_Open', pd.Series([0])), errors='coerce').fillna(0).sum()
             avg_delay = pd.to_numeric(df.get('Counting_Delay', pd.Series([0])), errors='coerce').fillna(0).mean()
-            critical_count = len(df[df.get('Priority_Level', '') == 'Crítica']) if 'Priority_Level' in df.columns else 0
-            high_count = len(df[df.get('Priority_Level', '') == 'Alta']) if 'Priority_Level' in df.columns else 0
+            # Un solo value_counts para Crítica y Alta en lugar de dos filtros
+            if 'Priority_Level' in df.columns:
+                priority_counts = df['Priority_Level'].value_counts()
+                critical_count = int(priority_counts.get('Crítica', 0))
+                high_count = int(priority_counts.get('Alta', 0))
+            else:
+                critical_count = 0
+                high_count = 0
             unique_wh = df.get('WH_Code', pd.Series([''])).nunique() if 'WH_Code' in df.columns else 0
             avg_score = pd.to_numeric(df.get('Priority_Score', pd.Series([0])), errors='coerce').fillna(0).mean()
             
@@ -2592,15 +2879,20 @@ def show_excel_analysis_tab():
         if len(excel_data) >= 2:
             st.success(f"✅ {len(excel_data)} archivos cargados correctamente")
             
-            # Mostrar información de archivos cargados
-            st.write("**Archivos procesados:**")
-            for date, df in excel_data.items():
-                st.write(f"- **{date}**: {len(df)} albaranes, {df['Total_Open'].sum() if 'Total_Open' in df.columns else 0} tablillas pendientes")
+            # Mostrar información de archivos cargados (una sola escritura para toda la lista)
+            st.markdown("**Archivos procesados:**\n" + '\n'.join(
+                f"- **{date}**: {len(df)} albaranes, {df['Total_Open'].sum() if 'Total_Open' in df.columns else 0} tablillas pendientes"
+                for date, df in excel_data.items()
+            ))
             
             # Realizar análisis comparativo
             analysis_results = analyzer.compare_excel_files(excel_data)
             
             if "error" not in analysis_results:
+                # Lanzar el informe Excel ya, para que se genere mientras se dibuja el dashboard
+                # (un intento fallido se relanza aquí, una sola vez por rerun)
+                report_future = submit_multi_day_report(analysis_results, excel_data, retry_failed=True)
+                
                 show_comparative_analysis(analysis_results, excel_data)
                 
                 # Opción de exportar informe profesional - VERSIÓN MEJORADA
@@ -2609,35 +2901,42 @@ def show_excel_analysis_tab():
                 
                 # NUEVO: Usar st.download_button para evitar recarga de página
                 col1, col2 = st.columns(2)
+                report_timestamp = datetime.now().strftime('%Y%m%d_%H%M')
                 
                 with col1:
                     # Generar el Excel en memoria
                     excel_data_bytes = export_professional_multi_day_report(analysis_results, excel_data)
                     
-                    st.download_button(
-                        label="📊 Descargar Informe Ejecutivo Multi-Días",
-                        data=excel_data_bytes,
-                        file_name=f"Informe_Ejecutivo_MultiDias_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        type="primary",
-                        help="Descarga el informe ejecutivo sin perder el dashboard"
-                    )
+                    if excel_data_bytes is not None:
+                        st.download_button(
+                            label="📊 Descargar Informe Ejecutivo Multi-Días",
+                            data=excel_data_bytes,
+                            file_name=f"Informe_Ejecutivo_MultiDias_{report_timestamp}.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            type="primary",
+                            help="Descarga el informe ejecutivo sin perder el dashboard"
+                        )
                 
                 with col2:
                     # Generar el Excel de tendencias en memoria
                     trends_data_bytes = export_comprehensive_trends_report(analysis_results, excel_data)
                     
-                    st.download_button(
-                        label="📈 Descargar Análisis Completo de Tendencias",
-                        data=trends_data_bytes,
-                        file_name=f"Analisis_Tendencias_Completo_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        type="secondary",
-                        help="Descarga el análisis completo sin perder el dashboard"
-                    )
+                    if trends_data_bytes is not None:
+                        st.download_button(
+                            label="📈 Descargar Análisis Completo de Tendencias",
+                            data=trends_data_bytes,
+                            file_name=f"Analisis_Tendencias_Completo_{report_timestamp}.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            type="secondary",
+                            help="Descarga el análisis completo sin perder el dashboard"
+                        )
                 
                 # NUEVO: Mensaje informativo
                 st.info("💡 **Tip:** Los archivos se descargan directamente sin afectar el dashboard. ¡Puedes seguir analizando mientras descargas!")
+                
+                # Informe aún en curso: la próxima interacción (o este botón) recoge el resultado
+                if not report_future.done():
+                    st.button("🔄 Comprobar informe", help="Vuelve a mirar si el informe Excel ya está listo")
             else:
                 st.error(analysis_results["error"])
         else:
@@ -2649,6 +2948,16 @@ def show_excel_analysis_tab():
     else:
         st.info("📂 Selecciona múltiples archivos Excel para comenzar el análisis")
 
+@st.cache_data(show_spinner=False)
+def read_excel_cached(path: str, mtime: float, size: int) -> pd.DataFrame:
+    """Leer un Excel del disco - cacheado por (ruta, fecha de modificación, tamaño)"""
+    return pd.read_excel(path)
+
+@st.cache_data(show_spinner=False)
+def read_excel_bytes(data: bytes, engine: str = 'openpyxl') -> pd.DataFrame:
+    """Leer un Excel subido desde sus bytes - cacheado por el contenido del archivo"""
+    return pd.read_excel(io.BytesIO(data), engine=engine)
+
 def load_excel_files_direct(uploaded_files) -> Dict[str, pd.DataFrame]:
     """Cargar archivos Excel directamente sin archivos temporales - NUEVA FUNCIÓN"""
     excel_data = {}
@@ -2657,8 +2966,8 @@ def load_excel_files_direct(uploaded_files) -> Dict[str, pd.DataFrame]:
         try:
             st.write(f"🔍 Procesando: {uploaded_file.name}")
             
-            # Leer directamente del objeto UploadedFile
-            df = pd.read_excel(uploaded_file, engine='openpyxl')
+            # Leer directamente del objeto UploadedFile (cacheado por contenido entre reruns)
+            df = read_excel_bytes(uploaded_file.getvalue(), engine='openpyxl')
             
             st.write(f"✅ Leído correctamente: {len(df)} filas, {len(df.columns)} columnas")
             
@@ -2678,7 +2987,7 @@ def load_excel_files_direct(uploaded_files) -> Dict[str, pd.DataFrame]:
             
             # NUEVO: Normalizar códigos de almacén en archivos Excel
             if 'WH_Code' in df.columns:
-                df['WH_Code'] = df['WH_Code'].str.upper()
+                df['WH_Code'] = uppercase_codes(df['WH_Code'])
                 st.info(f"🔧 Normalizados códigos de almacén en {file_name}")
             
             # Verificar que el DataFrame tiene las columnas esperadas
@@ -2705,8 +3014,7 @@ def load_excel_files_direct(uploaded_files) -> Dict[str, pd.DataFrame]:
             # Intentar con otro engine
             try:
                 st.write("🔄 Intentando con engine alternativo...")
-                uploaded_file.seek(0)  # Reset file pointer
-                df = pd.read_excel(uploaded_file, engine='xlrd')
+                df = read_excel_bytes(uploaded_file.getvalue(), engine='xlrd')
                 
                 # Extraer fecha
                 file_name = uploaded_file.name
@@ -2719,7 +3027,7 @@ def load_excel_files_direct(uploaded_files) -> Dict[str, pd.DataFrame]:
                 
                 # NUEVO: Normalizar códigos de almacén también en engine alternativo
                 if 'WH_Code' in df.columns:
-                    df['WH_Code'] = df['WH_Code'].str.upper()
+                    df['WH_Code'] = uppercase_codes(df['WH_Code'])
                     st.info(f"🔧 Normalizados códigos de almacén en {file_name} (engine alternativo)")
                 
                 excel_data[file_date] = df
@@ -2869,6 +3177,8 @@ def show_executive_dashboard(summary: Dict):
 
 def show_temporal_evolution(open_evolution: List[Dict]):
     """Mostrar evolución temporal - VERSIÓN MEJORADA"""
+    import plotly.express as px
+
     st.subheader("📈 Evolución de Tablillas Pendientes")
     
     if open_evolution:
@@ -3045,6 +3355,8 @@ def show_visual_analysis_dashboard(df: pd.DataFrame):
 
 def show_warehouse_analysis(df: pd.DataFrame):
     """Análisis comparativo por almacén"""
+    import plotly.graph_objects as go
+
     st.subheader("🏢 Análisis por Almacén")
     
     if 'WH_Code' not in df.columns:
@@ -3052,8 +3364,10 @@ def show_warehouse_analysis(df: pd.DataFrame):
         return
     
     # Preparar datos por almacén - CORREGIDO para incluir albaranes cerrados
-    wh_summary = df.groupby('WH_Code').agg({
-        'Total_Open': ['sum', lambda x: (x == 0).sum()],  # Suma de pendientes + conteo de cerrados
+    # El conteo de cerrados sale de una máscara vectorizada, no de una lambda por grupo
+    closed_counts = df['Total_Open'].eq(0).groupby(df['WH_Code'], observed=True).sum()
+    wh_summary = df.groupby('WH_Code', observed=True).agg({
+        'Total_Open': 'sum',
         'Total_Tablets': 'sum',
         'Counting_Delay': ['mean', 'max'],
         'Validation_Delay': 'mean',
@@ -3063,8 +3377,9 @@ def show_warehouse_analysis(df: pd.DataFrame):
     }).round(2)
     
     # Aplanar columnas multinivel
-    wh_summary.columns = ['Pendientes', 'Albaranes_Cerrados', 'Total_Tablillas', 'Retraso_Prom', 'Retraso_Max', 
+    wh_summary.columns = ['Pendientes', 'Total_Tablillas', 'Retraso_Prom', 'Retraso_Max', 
                          'Val_Delay_Prom', 'Num_Albaranes', 'Días_Prom', 'Score_Prom']
+    wh_summary.insert(1, 'Albaranes_Cerrados', closed_counts)
     wh_summary = wh_summary.reset_index()
     
     # Calcular métricas adicionales - CORREGIDO para usar lógica de albaranes cerrados
@@ -3075,44 +3390,58 @@ def show_warehouse_analysis(df: pd.DataFrame):
     col1, col2 = st.columns(2)
     
     with col1:
-        # Gráfico de tablillas pendientes por almacén
-        fig1 = px.bar(
-            wh_summary,
-            x='WH_Code',
-            y='Pendientes',
-            title='📊 Tablillas Pendientes por Almacén',
-            color='Eficiencia',
-            color_continuous_scale='RdYlGn',
-            text='Pendientes',
-            hover_data=['Num_Albaranes', 'Retraso_Prom']
-        )
-        
-        fig1.update_traces(texttemplate='%{text}', textposition='outside')
-        fig1.update_layout(
-            xaxis_title="Almacén",
-            yaxis_title="Tablillas Pendientes",
-            showlegend=False
-        )
+        # Gráfico de tablillas pendientes por almacén (spec directo, sin Plotly Express)
+        fig1 = go.Figure({
+            'data': [{
+                'type': 'bar',
+                'x': wh_summary['WH_Code'],
+                'y': wh_summary['Pendientes'],
+                'text': wh_summary['Pendientes'],
+                'texttemplate': '%{text}',
+                'textposition': 'outside',
+                'customdata': wh_summary[['Num_Albaranes', 'Retraso_Prom']].to_numpy(),
+                'hovertemplate': ('Almacén=%{x}<br>Pendientes=%{y}<br>'
+                                  'Num_Albaranes=%{customdata[0]}<br>Retraso_Prom=%{customdata[1]}'
+                                  '<extra></extra>'),
+                'marker': {
+                    'color': wh_summary['Eficiencia'],
+                    'colorscale': 'RdYlGn',
+                    'showscale': True,
+                    'colorbar': {'title': {'text': 'Eficiencia'}}
+                }
+            }],
+            'layout': {
+                'title': {'text': '📊 Tablillas Pendientes por Almacén'},
+                'xaxis': {'title': {'text': 'Almacén'}},
+                'yaxis': {'title': {'text': 'Tablillas Pendientes'}},
+                'showlegend': False
+            }
+        })
         st.plotly_chart(fig1, use_container_width=True)
     
     with col2:
-        # Gráfico de eficiencia por almacén
-        fig2 = px.scatter(
-            wh_summary,
-            x='Retraso_Prom',
-            y='Eficiencia',
-            size='Num_Albaranes',
-            color='WH_Code',
-            title='🎯 Eficiencia vs Retraso por Almacén',
-            hover_data=['Pendientes', 'Total_Tablillas'],
-            size_max=60
-        )
-        
-        fig2.update_layout(
-            xaxis_title="Retraso Promedio (días)",
-            yaxis_title="Eficiencia (%)",
-            legend_title="Almacén"
-        )
+        # Gráfico de eficiencia por almacén: una traza por almacén
+        sizeref = bubble_sizeref(wh_summary['Num_Albaranes'], size_max=60)
+        fig2 = go.Figure({
+            'data': [{
+                'type': 'scatter',
+                'mode': 'markers',
+                'name': str(row.WH_Code),
+                'x': [row.Retraso_Prom],
+                'y': [row.Eficiencia],
+                'customdata': [[row.Pendientes, row.Total_Tablillas]],
+                'hovertemplate': ('Almacén=' + str(row.WH_Code) + '<br>Retraso_Prom=%{x}<br>'
+                                  'Eficiencia=%{y}<br>Pendientes=%{customdata[0]}<br>'
+                                  'Total_Tablillas=%{customdata[1]}<extra></extra>'),
+                'marker': {'size': [row.Num_Albaranes], 'sizemode': 'area', 'sizeref': sizeref}
+            } for row in wh_summary.itertuples(index=False)],
+            'layout': {
+                'title': {'text': '🎯 Eficiencia vs Retraso por Almacén'},
+                'xaxis': {'title': {'text': 'Retraso Promedio (días)'}},
+                'yaxis': {'title': {'text': 'Eficiencia (%)'}},
+                'legend': {'title': {'text': 'Almacén'}}
+            }
+        })
         
         # Líneas de referencia
         fig2.add_hline(y=80, line_dash="dash", line_color="green", 
@@ -3147,29 +3476,66 @@ def show_warehouse_analysis(df: pd.DataFrame):
     
     st.dataframe(styled_summary, use_container_width=True)
     
-    # Rankings de almacenes
+    # Rankings de almacenes - un solo argmax sobre las tres columnas
+    ranking_idx = np.nanargmax(
+        wh_summary[['Eficiencia', 'Retraso_Prom', 'Pendientes']].to_numpy(dtype=float), axis=0
+    )
+    best_efficiency = wh_summary.iloc[ranking_idx[0]]
+    worst_delay = wh_summary.iloc[ranking_idx[1]]
+    most_pending = wh_summary.iloc[ranking_idx[2]]
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        best_efficiency = wh_summary.loc[wh_summary['Eficiencia'].idxmax()]
         st.metric("🏆 Mejor Eficiencia", 
                  f"{best_efficiency['WH_Code']}", 
                  f"{best_efficiency['Eficiencia']:.1f}%")
     
     with col2:
-        worst_delay = wh_summary.loc[wh_summary['Retraso_Prom'].idxmax()]
         st.metric("⚠️ Mayor Retraso", 
                  f"{worst_delay['WH_Code']}", 
                  f"{worst_delay['Retraso_Prom']:.1f} días")
     
     with col3:
-        most_pending = wh_summary.loc[wh_summary['Pendientes'].idxmax()]
         st.metric("📊 Más Pendientes", 
                  f"{most_pending['WH_Code']}", 
                  f"{most_pending['Pendientes']} tablillas")
 
+def write_sheet_columns(writer: pd.ExcelWriter, df: pd.DataFrame, sheet_name: str):
+    """Escribir una hoja grande columna a columna directamente con xlsxwriter.
+    
+    Evita la celda-por-celda de DataFrame.to_excel en las hojas de detalle;
+    mantiene el mismo formato de encabezado y deja vacías las celdas nulas.
+    """
+    worksheet = writer.book.add_worksheet(sheet_name)
+    header_format = writer.book.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+    
+    for col_idx, column in enumerate(df.columns):
+        series = df[column]
+        values = series.astype(object).where(series.notna(), None).tolist()
+        worksheet.write_column(1, col_idx, values)
+
+def hash_dataframe(df: pd.DataFrame) -> Tuple:
+    """Huella del contenido completo de un DataFrame para las claves de st.cache_data"""
+    return (tuple(df.columns), df.shape, int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_current_month_start() -> np.datetime64:
+    """Inicio del mes actual (00:00 del día 1), cacheado entre reruns"""
+    return np.datetime64(pd.Timestamp.now().normalize().replace(day=1), 'ns')
+
+def bubble_sizeref(sizes: pd.Series, size_max: int = 20) -> float:
+    """Calcular sizeref igual que Plotly Express para marcadores en modo 'area'"""
+    max_size = pd.to_numeric(sizes, errors='coerce').max()
+    if pd.isna(max_size) or max_size <= 0:
+        return 1.0
+    return 2.0 * float(max_size) / (size_max ** 2)
+
 def show_aging_analysis(df: pd.DataFrame):
     """Análisis de antigüedad de albaranes"""
+    import plotly.graph_objects as go
+
     st.subheader("⏰ Análisis de Antigüedad de Albaranes")
     
     if 'Days_Since_Return' not in df.columns or 'Return_Date' not in df.columns:
@@ -3209,44 +3575,54 @@ def show_aging_analysis(df: pd.DataFrame):
             '🚨 Crítico (>30 días)': '#dc3545'
         }
         
-        fig3 = px.pie(
-            values=age_dist.values,
-            names=age_dist.index,
-            title='📊 Distribución por Antigüedad',
-            color=age_dist.index,
-            color_discrete_map=colors
-        )
+        fig3 = go.Figure({
+            'data': [{
+                'type': 'pie',
+                'values': age_dist.values,
+                'labels': age_dist.index,
+                'textinfo': 'percent+label',
+                'marker': {'colors': [colors.get(category) for category in age_dist.index]}
+            }],
+            'layout': {'title': {'text': '📊 Distribución por Antigüedad'}}
+        })
         
-        fig3.update_traces(textinfo='percent+label')
         st.plotly_chart(fig3, use_container_width=True)
     
     with col2:
-        # Timeline de albaranes más antiguos
-        oldest_15 = pending_df.nlargest(15, 'Days_Since_Return')[
+        # Timeline de albaranes más antiguos (proyectar columnas antes de ordenar)
+        oldest_15 = pending_df[
             ['Return_Packing_Slip', 'Customer_Name', 'Days_Since_Return', 'Total_Open', 'WH_Code']
-        ].copy()
-        
-        fig4 = px.bar(
-            oldest_15,
-            x='Days_Since_Return',
-            y='Return_Packing_Slip',
-            orientation='h',
-            title='⏱️ Top 15 Albaranes Más Antiguos',
-            color='Total_Open',
-            color_continuous_scale='Reds',
-            hover_data=['Customer_Name', 'WH_Code']
-        )
+        ].nlargest(15, 'Days_Since_Return')
         
-        fig4.update_layout(
-            xaxis_title="Días desde Retorno",
-            yaxis_title="Albarán",
-            height=500
-        )
+        fig4 = go.Figure({
+            'data': [{
+                'type': 'bar',
+                'orientation': 'h',
+                'x': oldest_15['Days_Since_Return'],
+                'y': oldest_15['Return_Packing_Slip'],
+                'customdata': oldest_15[['Customer_Name', 'WH_Code', 'Total_Open']].to_numpy(),
+                'hovertemplate': ('Días=%{x}<br>Albarán=%{y}<br>Customer_Name=%{customdata[0]}<br>'
+                                  'WH_Code=%{customdata[1]}<br>Total_Open=%{customdata[2]}'
+                                  '<extra></extra>'),
+                'marker': {
+                    'color': oldest_15['Total_Open'],
+                    'colorscale': 'Reds',
+                    'showscale': True,
+                    'colorbar': {'title': {'text': 'Total_Open'}}
+                }
+            }],
+            'layout': {
+                'title': {'text': '⏱️ Top 15 Albaranes Más Antiguos'},
+                'xaxis': {'title': {'text': 'Días desde Retorno'}},
+                'yaxis': {'title': {'text': 'Albarán'}},
+                'height': 500
+            }
+        })
         
         st.plotly_chart(fig4, use_container_width=True)
     
     # Análisis del mes actual
-    current_month = pd.Timestamp.now().replace(day=1)
+    current_month = get_current_month_start()
     
     # Asegurar que Return_Date sea datetime
     if 'Return_Date' in pending_df.columns:
@@ -3262,7 +3638,7 @@ def show_aging_analysis(df: pd.DataFrame):
     if not month_old.empty:
         st.markdown("### 🚨 Albaranes NO Resueltos del Mes Anterior")
         
-        month_summary = month_old.groupby('WH_Code').agg({
+        month_summary = month_old.groupby('WH_Code', observed=True).agg({
             'Total_Open': 'sum',
             'Return_Packing_Slip': 'count',
             'Days_Since_Return': 'mean'
@@ -3286,6 +3662,8 @@ def show_aging_analysis(df: pd.DataFrame):
 
 def show_performance_analysis(df: pd.DataFrame):
     """Análisis de performance y tendencias"""
+    import plotly.graph_objects as go
+
     st.subheader("📈 Análisis de Performance")
     
     # Análisis de prioridades por almacén
@@ -3295,81 +3673,115 @@ def show_performance_analysis(df: pd.DataFrame):
         
         with col1:
             # Distribución de prioridades por almacén
-            priority_by_wh = df.groupby(['WH_Code', 'Priority_Level']).size().reset_index(name='count')
-            
-            fig5 = px.bar(
-                priority_by_wh,
-                x='WH_Code',
-                y='count',
-                color='Priority_Level',
-                title='🎯 Distribución de Prioridades por Almacén',
-                color_discrete_map={
-                    'Baja': '#28a745',
-                    'Media': '#ffc107',
-                    'Alta': '#fd7e14', 
-                    'Crítica': '#dc3545'
-                }
-            )
+            priority_by_wh = df.groupby(['WH_Code', 'Priority_Level'], observed=True).size().reset_index(name='count')
             
-            fig5.update_layout(
-                xaxis_title="Almacén",
-                yaxis_title="Cantidad de Albaranes",
-                legend_title="Prioridad"
-            )
+            priority_colors = {
+                'Baja': '#28a745',
+                'Media': '#ffc107',
+                'Alta': '#fd7e14', 
+                'Crítica': '#dc3545'
+            }
+            
+            fig5 = go.Figure({
+                'data': [{
+                    'type': 'bar',
+                    'name': str(level),
+                    'x': level_df['WH_Code'],
+                    'y': level_df['count'],
+                    'marker': {'color': priority_colors.get(level)}
+                } for level, level_df in priority_by_wh.groupby('Priority_Level', sort=False, observed=True)],
+                'layout': {
+                    'title': {'text': '🎯 Distribución de Prioridades por Almacén'},
+                    'barmode': 'relative',
+                    'xaxis': {'title': {'text': 'Almacén'}},
+                    'yaxis': {'title': {'text': 'Cantidad de Albaranes'}},
+                    'legend': {'title': {'text': 'Prioridad'}}
+                }
+            })
             
             st.plotly_chart(fig5, use_container_width=True)
         
         with col2:
             # Correlación entre días y tablillas pendientes
             if 'Days_Since_Return' in df.columns:
-                fig6 = px.scatter(
-                    df[df['Total_Open'] > 0],
-                    x='Days_Since_Return',
-                    y='Total_Open',
-                    color='WH_Code',
-                    size='Priority_Score',
-                    title='📊 Relación: Antigüedad vs Tablillas Pendientes',
-                    hover_data=['Customer_Name', 'Return_Packing_Slip']
-                )
+                open_df = df[df['Total_Open'] > 0]
+                sizeref = bubble_sizeref(open_df['Priority_Score'])
                 
-                fig6.update_layout(
-                    xaxis_title="Días desde Retorno",
-                    yaxis_title="Tablillas Pendientes"
-                )
+                fig6 = go.Figure({
+                    'data': [{
+                        'type': 'scatter',
+                        'mode': 'markers',
+                        'name': str(wh),
+                        'x': wh_df['Days_Since_Return'],
+                        'y': wh_df['Total_Open'],
+                        'customdata': wh_df[['Customer_Name', 'Return_Packing_Slip']].to_numpy(),
+                        'hovertemplate': ('Almacén=' + str(wh) + '<br>Días=%{x}<br>Pendientes=%{y}<br>'
+                                          'Customer_Name=%{customdata[0]}<br>'
+                                          'Return_Packing_Slip=%{customdata[1]}<extra></extra>'),
+                        'marker': {'size': wh_df['Priority_Score'], 'sizemode': 'area', 'sizeref': sizeref}
+                    } for wh, wh_df in open_df.groupby('WH_Code', sort=False, observed=True)],
+                    'layout': {
+                        'title': {'text': '📊 Relación: Antigüedad vs Tablillas Pendientes'},
+                        'xaxis': {'title': {'text': 'Días desde Retorno'}},
+                        'yaxis': {'title': {'text': 'Tablillas Pendientes'}},
+                        'legend': {'title': {'text': 'WH_Code'}}
+                    }
+                })
                 
                 st.plotly_chart(fig6, use_container_width=True)
     
     # Métricas de performance
     show_performance_metrics(df)
 
-def show_performance_metrics(df: pd.DataFrame):
-    """Mostrar métricas clave de performance"""
-    st.subheader("🎯 Métricas Clave de Performance")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    # Calcular métricas
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: lambda d: hash_dataframe(d[d.columns.intersection(KPI_COLUMNS)])})
+def compute_performance_kpis(df: pd.DataFrame, current_month: np.datetime64) -> Dict:
+    """Calcular las métricas clave - cacheado por el contenido de las columnas que usa"""
+    # Calcular métricas - una pasada por columna sobre arrays NumPy, sin df[mask]
+    available = set(df.columns)
     total_albaranes = len(df)
-    total_pending = df.get('Total_Open', pd.Series([0])).sum()
-    total_tablets = df.get('Total_Tablets', pd.Series([0])).sum()
     
     # CORREGIDO: Tasa de Finalización = Albaranes cerrados / Total albaranes
     # Un albarán está cerrado cuando Total_Open = 0
-    closed_albaranes = len(df[df.get('Total_Open', pd.Series([0])) == 0])
+    if 'Total_Open' in available:
+        closed_albaranes = int((df['Total_Open'].to_numpy() == 0).sum())
+    else:
+        closed_albaranes = total_albaranes
     
     if total_albaranes > 0:
         completion_rate = (closed_albaranes / total_albaranes * 100)
     else:
         completion_rate = 0
     
-    avg_age = df.get('Days_Since_Return', pd.Series([0])).mean()
+    avg_age = df['Days_Since_Return'].mean() if 'Days_Since_Return' in available else 0
     
-    critical_count = len(df[df.get('Priority_Level', '') == 'Crítica'])
+    if 'Priority_Level' in available:
+        critical_count = int((df['Priority_Level'].to_numpy() == 'Crítica').sum())
+    else:
+        critical_count = 0
     
     old_month_count = 0
-    if 'Return_Date' in df.columns:
-        current_month = pd.Timestamp.now().replace(day=1)
-        old_month_count = len(df[df['Return_Date'] < current_month])
+    if 'Return_Date' in available:
+        return_dates = pd.to_datetime(df['Return_Date'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+        old_month_count = int((return_dates < current_month).sum())
+    
+    return {
+        'completion_rate': completion_rate,
+        'avg_age': avg_age,
+        'critical_count': critical_count,
+        'old_month_count': old_month_count
+    }
+
+def show_performance_metrics(df: pd.DataFrame):
+    """Mostrar métricas clave de performance"""
+    st.subheader("🎯 Métricas Clave de Performance")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    kpis = compute_performance_kpis(df, get_current_month_start())
+    completion_rate = kpis['completion_rate']
+    avg_age = kpis['avg_age']
+    critical_count = kpis['critical_count']
+    old_month_count = kpis['old_month_count']
     
     with col1:
         st.metric("📊 Tasa de Finalización", 
@@ -3427,39 +3839,55 @@ def show_trend_analysis(excel_data: Dict[str, pd.DataFrame]):
         wh_trends = analyze_warehouse_trends(excel_data, dates)
         show_warehouse_trends(wh_trends)
 
-def analyze_warehouse_trends(excel_data: Dict[str, pd.DataFrame], dates: List[str]) -> Dict:
+def analyze_warehouse_trends(excel_data: Dict[str, pd.DataFrame], dates: List[str]) -> pd.DataFrame:
     """Analizar tendencias por almacén"""
-    wh_data = {}
+    return aggregate_by_date_and_warehouse(
+        excel_data, tuple(dates), sort=False, total_open=('Total_Open', 'sum')
+    )
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
+def aggregate_by_date_and_warehouse(excel_data: Dict[str, pd.DataFrame], dates: Tuple[str, ...],
+                                    sort: bool = True, **aggregations) -> pd.DataFrame:
+    """Concatenar todas las fechas y agrupar por (date, WH_Code) en un solo groupby.
+    
+    Las fechas sin alguna de las columnas necesarias se omiten. Cacheado por contenido
+    para que tendencias e informe no repitan la agregación en cada rerun.
+    """
+    columns = ['WH_Code'] + sorted({column for column, _ in aggregations.values()})
+    frames = [
+        excel_data[date][columns].assign(date=date)
+        for date in dates
+        if set(columns).issubset(excel_data[date].columns)
+    ]
     
-    for date in dates:
-        df = excel_data[date]
-        
-        if 'WH_Code' in df.columns and 'Total_Open' in df.columns:
-            wh_summary = df.groupby('WH_Code')['Total_Open'].sum()
-            
-            for wh, total_open in wh_summary.items():
-                if wh not in wh_data:
-                    wh_data[wh] = []
-                wh_data[wh].append({'date': date, 'total_open': total_open})
+    if not frames:
+        return pd.DataFrame(columns=['date', 'WH_Code', *aggregations])
     
-    return wh_data
+    return (
+        pd.concat(frames, ignore_index=True)
+        .groupby(['date', 'WH_Code'], sort=sort, observed=True)
+        .agg(**aggregations)
+        .reset_index()
+    )
 
-def show_warehouse_trends(wh_trends: Dict):
+def show_warehouse_trends(wh_trends: pd.DataFrame):
     """Mostrar tendencias por almacén"""
-    if wh_trends:
+    import plotly.graph_objects as go
+
+    if not wh_trends.empty:
         st.subheader("🏢 Tendencias por Almacén")
         
         # Crear gráfico de líneas múltiples
         fig = go.Figure()
         
-        for wh, data in wh_trends.items():
-            if len(data) >= 2:  # Solo mostrar almacenes con al menos 2 puntos de datos
-                df_wh = pd.DataFrame(data)
-                df_wh['date'] = pd.to_datetime(df_wh['date'])
-                
+        # Convertir las fechas una sola vez para todos los almacenes
+        wh_trends = wh_trends.assign(date=pd.to_datetime(wh_trends['date']))
+        
+        for wh, wh_df in wh_trends.groupby('WH_Code', sort=False):
+            if len(wh_df) >= 2:  # Solo mostrar almacenes con al menos 2 puntos de datos
                 fig.add_trace(go.Scatter(
-                    x=df_wh['date'],
-                    y=df_wh['total_open'],
+                    x=wh_df['date'],
+                    y=wh_df['total_open'],
                     mode='lines+markers',
                     name=f"Almacén {wh}",
                     line=dict(width=3)
@@ -3474,217 +3902,248 @@ def show_warehouse_trends(wh_trends: Dict):
         
         st.plotly_chart(fig, use_container_width=True)
 
-def export_professional_multi_day_report(analysis_results: Dict, excel_data: Dict[str, pd.DataFrame]):
-    """Exportar informe profesional multi-días - VERSIÓN MEJORADA Y OPTIMIZADA"""
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
+def build_multi_day_report_bytes(analysis_results: Dict, excel_data: Dict[str, pd.DataFrame],
+                                 _progress_state: Optional[Dict] = None) -> bytes:
+    """Construir el informe multi-días en memoria - cacheado por contenido entre reruns.
+    
+    No toca elementos de Streamlit: el avance se anota en ``_progress_state``
+    (un dict simple) y lo dibuja quien llama, así un acierto de caché no reproduce UI.
+    """
     output = io.BytesIO()
     
-    # NUEVO: Mostrar progreso de generación
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    try:
-        status_text.text("🔄 Generando informe ejecutivo...")
-        progress_bar.progress(10)
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    if _progress_state is not None:
+        _progress_state.update(percent=10, message="🔄 Generando informe ejecutivo...")
+    with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs=XLSX_WRITER_KWARGS) as writer:
+        
+        # HOJA 1: Dashboard Ejecutivo (MEJORADO)
+        summary = analysis_results.get('summary', {})
+        
+        # Calcular métricas avanzadas
+        total_new = summary.get('total_new_albaranes', 0)
+        total_closed = summary.get('total_closed_albaranes', 0)
+        total_tablets_closed = summary.get('total_closed_tablets', 0)
+        total_tablets_added = summary.get('total_added_tablets', 0)
+        num_files = summary.get('num_files_analyzed', 0)
+        analysis_period = summary.get('analysis_period', 'N/A')
+        oldest_date = summary.get('oldest_date', 'N/A')
+        most_recent_date = summary.get('most_recent_date', 'N/A')
+        open_evolution = summary.get('open_evolution')
+        comparisons = analysis_results.get('comparisons', [])
+        
+        # Métricas de performance - CORREGIDO para usar lógica de albaranes cerrados
+        # Eficiencia = Albaranes cerrados / (Albaranes cerrados + Albaranes nuevos)
+        closed_plus_new = max(total_closed + total_new, 1)
+        efficiency = total_closed / closed_plus_new * 100
+        activity_score = (total_tablets_closed + total_tablets_added) / max(num_files, 1)
+        closure_rate = efficiency  # Misma fórmula: cerrados / (cerrados + nuevos)
+        
+        executive_data = {
+            '📊 MÉTRICA': [
+                '📅 Período de Análisis',
+                '📁 Archivos Analizados',
+                '📉 Fecha Más Antigua',
+                '📈 Fecha Más Reciente',
+                '',
+                '🆕 NUEVOS ALBARANES',
+                '✅ ALBARANES CERRADOS',
+                '🔒 TABLILLAS CERRADAS',
+                '➕ TABLILLAS AGREGADAS',
+                '',
+                '📊 EFICIENCIA DE CIERRE (%)',
+                '🎯 SCORE DE ACTIVIDAD',
+                '⚡ TASA DE CIERRE (%)',
+                '📈 NETO TABLILLAS',
+                '🔄 RATIO CIERRE/NUEVO'
+            ],
+            '📈 VALOR': [
+                analysis_period,
+                num_files,
+                oldest_date,
+                most_recent_date,
+                '',
+                total_new,
+                total_closed,
+                total_tablets_closed,
+                total_tablets_added,
+                '',
+                f"{efficiency:.1f}%",
+                f"{activity_score:.1f}",
+                f"{closure_rate:.1f}%",
+                total_tablets_closed - total_tablets_added,
+                f"{total_closed / total_new:.2f}" if total_new > 0 else "N/A"
+            ],
+            '💡 INTERPRETACIÓN': [
+                'Período analizado',
+                'Cantidad de archivos procesados',
+                'Fecha del primer archivo',
+                'Fecha del último archivo',
+                '',
+                'Albaranes nuevos en el período',
+                'Albaranes completamente cerrados',
+                'Tablillas cerradas en total',
+                'Tablillas agregadas en total',
+                '',
+                'Porcentaje de tablillas cerradas vs agregadas',
+                'Actividad promedio por archivo',
+                'Porcentaje de albaranes cerrados vs nuevos',
+                'Balance neto de tablillas',
+                'Relación entre cierres y nuevos albaranes'
+            ]
+        }
+        executive_df = pd.DataFrame(executive_data)
+        executive_df.to_excel(writer, sheet_name='🎯 Dashboard_Ejecutivo', index=False)
+        
+        if _progress_state is not None:
+            _progress_state.update(percent=30, message="📊 Procesando evolución diaria...")
+        
+        # HOJA 2: Evolución Diaria (MEJORADA)
+        if open_evolution:
+            evolution_df = pd.DataFrame(open_evolution)
+            evolution_df['date'] = pd.to_datetime(evolution_df['date'])
+            
+            # Agregar métricas calculadas
+            evolution_df['cambio_diario'] = evolution_df['total_open'].diff()
+            evolution_df['cambio_porcentual'] = (evolution_df['total_open'].pct_change() * 100).round(2)
+            evolution_df['tendencia'] = evolution_df['cambio_diario'].apply(
+                lambda x: '📈 CRECIENTE' if x > 0 else '📉 DECRECIENTE' if x < 0 else '➡️ ESTABLE'
+            )
             
-            # HOJA 1: Dashboard Ejecutivo (MEJORADO)
-            summary = analysis_results.get('summary', {})
+            # Renombrar columnas para mejor presentación
+            evolution_df = evolution_df.rename(columns={
+                'date': '📅 FECHA',
+                'total_open': '🔢 TABLILLAS PENDIENTES',
+                'cambio_diario': '📊 CAMBIO DIARIO',
+                'cambio_porcentual': '📈 CAMBIO %',
+                'tendencia': '🎯 TENDENCIA'
+            })
             
-            # Calcular métricas avanzadas
-            total_new = summary.get('total_new_albaranes', 0)
-            total_closed = summary.get('total_closed_albaranes', 0)
-            total_tablets_closed = summary.get('total_closed_tablets', 0)
-            total_tablets_added = summary.get('total_added_tablets', 0)
-            num_files = summary.get('num_files_analyzed', 1)
-            
-            # Métricas de performance - CORREGIDO para usar lógica de albaranes cerrados
-            # Eficiencia = Albaranes cerrados / (Albaranes cerrados + Albaranes nuevos)
-            efficiency = (total_closed / max(total_closed + total_new, 1)) * 100
-            activity_score = (total_tablets_closed + total_tablets_added) / max(num_files, 1)
-            closure_rate = (total_closed / max(total_new + total_closed, 1)) * 100
-            
-            executive_data = {
-                '📊 MÉTRICA': [
-                    '📅 Período de Análisis',
-                    '📁 Archivos Analizados',
-                    '📉 Fecha Más Antigua',
-                    '📈 Fecha Más Reciente',
-                    '',
-                    '🆕 NUEVOS ALBARANES',
-                    '✅ ALBARANES CERRADOS',
-                    '🔒 TABLILLAS CERRADAS',
-                    '➕ TABLILLAS AGREGADAS',
-                    '',
-                    '📊 EFICIENCIA DE CIERRE (%)',
-                    '🎯 SCORE DE ACTIVIDAD',
-                    '⚡ TASA DE CIERRE (%)',
-                    '📈 NETO TABLILLAS',
-                    '🔄 RATIO CIERRE/NUEVO'
-                ],
-                '📈 VALOR': [
-                    summary.get('analysis_period', 'N/A'),
-                    summary.get('num_files_analyzed', 0),
-                    summary.get('oldest_date', 'N/A'),
-                    summary.get('most_recent_date', 'N/A'),
-                    '',
-                    total_new,
-                    total_closed,
-                    total_tablets_closed,
-                    total_tablets_added,
-                    '',
-                    f"{efficiency:.1f}%",
-                    f"{activity_score:.1f}",
-                    f"{closure_rate:.1f}%",
-                    total_tablets_closed - total_tablets_added,
-                    f"{total_closed / max(total_new, 1):.2f}" if total_new > 0 else "N/A"
-                ],
-                '💡 INTERPRETACIÓN': [
-                    'Período analizado',
-                    'Cantidad de archivos procesados',
-                    'Fecha del primer archivo',
-                    'Fecha del último archivo',
-                    '',
-                    'Albaranes nuevos en el período',
-                    'Albaranes completamente cerrados',
-                    'Tablillas cerradas en total',
-                    'Tablillas agregadas en total',
-                    '',
-                    'Porcentaje de tablillas cerradas vs agregadas',
-                    'Actividad promedio por archivo',
-                    'Porcentaje de albaranes cerrados vs nuevos',
-                    'Balance neto de tablillas',
-                    'Relación entre cierres y nuevos albaranes'
-                ]
-            }
-            executive_df = pd.DataFrame(executive_data)
-            executive_df.to_excel(writer, sheet_name='🎯 Dashboard_Ejecutivo', index=False)
-            
-            status_text.text("📊 Procesando evolución diaria...")
-            progress_bar.progress(30)
-            
-            # HOJA 2: Evolución Diaria (MEJORADA)
-            if 'open_evolution' in summary:
-                evolution_df = pd.DataFrame(summary['open_evolution'])
-                evolution_df['date'] = pd.to_datetime(evolution_df['date'])
-                
-                # Agregar métricas calculadas
-                evolution_df['cambio_diario'] = evolution_df['total_open'].diff()
-                evolution_df['cambio_porcentual'] = (evolution_df['total_open'].pct_change() * 100).round(2)
-                evolution_df['tendencia'] = evolution_df['cambio_diario'].apply(
-                    lambda x: '📈 CRECIENTE' if x > 0 else '📉 DECRECIENTE' if x < 0 else '➡️ ESTABLE'
-                )
-                
-                # Renombrar columnas para mejor presentación
-                evolution_df = evolution_df.rename(columns={
-                    'date': '📅 FECHA',
-                    'total_open': '🔢 TABLILLAS PENDIENTES',
-                    'cambio_diario': '📊 CAMBIO DIARIO',
-                    'cambio_porcentual': '📈 CAMBIO %',
-                    'tendencia': '🎯 TENDENCIA'
-                })
+            evolution_df.to_excel(writer, sheet_name='📈 Evolución_Diaria', index=False)
+        
+        if _progress_state is not None:
+            _progress_state.update(percent=60, message="🔄 Procesando cambios diarios...")
+        
+        # HOJA 3: Cambios Día a Día (MEJORADA)
+        if comparisons:
+            # Buffers columnares: una lista por columna en lugar de un dict por fila
+            daily_changes = {column: [] for column in [
+                '📅 FECHA ANTERIOR', '📅 FECHA ACTUAL', '🆕 NUEVOS ALBARANES',
+                '✅ ALBARANES CERRADOS', '🔒 TABLILLAS CERRADAS', '➕ TABLILLAS AGREGADAS',
+                '📊 NETO TABLILLAS', '📈 EFICIENCIA (%)', '🔢 TOTAL PENDIENTES ANTERIOR',
+                '🔢 TOTAL PENDIENTES ACTUAL', '📊 VARIACIÓN PENDIENTES', '🎯 TENDENCIA',
+                '⚡ ALBARANES CON AGREGADOS'
+            ]}
+            for comp in comparisons:
+                # Calcular métricas adicionales - CORREGIDO para usar lógica de albaranes cerrados
+                net_change = comp['current_total_open'] - comp['previous_total_open']
+                # Eficiencia = Albaranes cerrados / (Albaranes cerrados + Albaranes nuevos)
+                efficiency = (comp['closed_albaranes'] / max(comp['closed_albaranes'] + comp['new_albaranes'], 1)) * 100
+                added_tablets = comp.get('added_tablets', 0)
                 
-                evolution_df.to_excel(writer, sheet_name='📈 Evolución_Diaria', index=False)
-            
-            status_text.text("🔄 Procesando cambios diarios...")
-            progress_bar.progress(60)
+                daily_changes['📅 FECHA ANTERIOR'].append(comp['previous_date'])
+                daily_changes['📅 FECHA ACTUAL'].append(comp['current_date'])
+                daily_changes['🆕 NUEVOS ALBARANES'].append(comp['new_albaranes'])
+                daily_changes['✅ ALBARANES CERRADOS'].append(comp['closed_albaranes'])
+                daily_changes['🔒 TABLILLAS CERRADAS'].append(comp['closed_tablets'])
+                daily_changes['➕ TABLILLAS AGREGADAS'].append(added_tablets)
+                daily_changes['📊 NETO TABLILLAS'].append(comp['closed_tablets'] - added_tablets)
+                daily_changes['📈 EFICIENCIA (%)'].append(f"{efficiency:.1f}%")
+                daily_changes['🔢 TOTAL PENDIENTES ANTERIOR'].append(comp['previous_total_open'])
+                daily_changes['🔢 TOTAL PENDIENTES ACTUAL'].append(comp['current_total_open'])
+                daily_changes['📊 VARIACIÓN PENDIENTES'].append(net_change)
+                daily_changes['🎯 TENDENCIA'].append(
+                    '📈 CRECIENTE' if net_change > 0 else '📉 DECRECIENTE' if net_change < 0 else '➡️ ESTABLE'
+                )
+                daily_changes['⚡ ALBARANES CON AGREGADOS'].append(comp.get('albaranes_with_added_tablets', 0))
             
-            # HOJA 3: Cambios Día a Día (MEJORADA)
-            if 'comparisons' in analysis_results:
-                daily_changes = []
-                for comp in analysis_results['comparisons']:
-                    # Calcular métricas adicionales - CORREGIDO para usar lógica de albaranes cerrados
-                    net_change = comp['current_total_open'] - comp['previous_total_open']
-                    # Eficiencia = Albaranes cerrados / (Albaranes cerrados + Albaranes nuevos)
-                    efficiency = (comp['closed_albaranes'] / max(comp['closed_albaranes'] + comp['new_albaranes'], 1)) * 100
-                    
-                    daily_changes.append({
-                        '📅 FECHA ANTERIOR': comp['previous_date'],
-                        '📅 FECHA ACTUAL': comp['current_date'],
-                        '🆕 NUEVOS ALBARANES': comp['new_albaranes'],
-                        '✅ ALBARANES CERRADOS': comp['closed_albaranes'],
-                        '🔒 TABLILLAS CERRADAS': comp['closed_tablets'],
-                        '➕ TABLILLAS AGREGADAS': comp.get('added_tablets', 0),
-                        '📊 NETO TABLILLAS': comp['closed_tablets'] - comp.get('added_tablets', 0),
-                        '📈 EFICIENCIA (%)': f"{efficiency:.1f}%",
-                        '🔢 TOTAL PENDIENTES ANTERIOR': comp['previous_total_open'],
-                        '🔢 TOTAL PENDIENTES ACTUAL': comp['current_total_open'],
-                        '📊 VARIACIÓN PENDIENTES': net_change,
-                        '🎯 TENDENCIA': '📈 CRECIENTE' if net_change > 0 else '📉 DECRECIENTE' if net_change < 0 else '➡️ ESTABLE',
-                        '⚡ ALBARANES CON AGREGADOS': comp.get('albaranes_with_added_tablets', 0)
-                    })
-                
-                daily_changes_df = pd.DataFrame(daily_changes)
-                daily_changes_df.to_excel(writer, sheet_name='🔄 Cambios_Diarios', index=False)
-            
-            status_text.text("📋 Procesando detalles de cambios...")
-            progress_bar.progress(80)
-            
-            # HOJA 4: Detalles de Cambios
-            all_changes = []
-            for comp in analysis_results.get('comparisons', []):
-                for change in comp.get('changed_albaranes', []):
-                    all_changes.append({
-                        'Fecha': comp['current_date'],
-                        'Albarán': change['albaran'],
-                        'Cliente': change['customer'],
-                        'Open_Anterior': change['previous_open'],
-                        'Open_Actual': change['current_open'],
-                        'Total_Anterior': change['previous_total'],
-                        'Total_Actual': change['current_total'],
-                        'Cambios': ' | '.join(change['changes'])
-                    })
-            
-            if all_changes:
-                changes_detail_df = pd.DataFrame(all_changes)
-                changes_detail_df.to_excel(writer, sheet_name='Detalles_Cambios', index=False)
-            
-            status_text.text("🏢 Procesando análisis por almacén...")
-            progress_bar.progress(90)
-            
-            # HOJA 5: Análisis por Almacén
-            warehouse_analysis = []
-            dates = sorted(excel_data.keys())
+            daily_changes_df = pd.DataFrame(daily_changes, copy=False)
+            daily_changes_df.to_excel(writer, sheet_name='🔄 Cambios_Diarios', index=False)
+        
+        if _progress_state is not None:
+            _progress_state.update(percent=80, message="📋 Procesando detalles de cambios...")
+        
+        # HOJA 4: Detalles de Cambios
+        # Un DataFrame por comparación construido en bloque desde los registros,
+        # concatenados una sola vez
+        change_frames = []
+        for comp in comparisons:
+            changed_albaranes = comp.get('changed_albaranes', [])
+            if not changed_albaranes:
+                continue
             
-            for date in dates:
-                df = excel_data[date]
-                if 'WH_Code' in df.columns and 'Total_Open' in df.columns:
-                    wh_summary = df.groupby('WH_Code').agg({
-                        'Total_Open': 'sum',
-                        'Total_Tablets': 'sum',
-                        'Return_Packing_Slip': 'count'
-                    }).reset_index()
-                    
-                    for _, row in wh_summary.iterrows():
-                        warehouse_analysis.append({
-                            'Fecha': date,
-                            'Almacén': row['WH_Code'],
-                            'Tablillas_Pendientes': row['Total_Open'],
-                            'Total_Tablillas': row['Total_Tablets'],
-                            'Número_Albaranes': row['Return_Packing_Slip']
-                        })
-            
-            if warehouse_analysis:
-                warehouse_df = pd.DataFrame(warehouse_analysis)
-                warehouse_df.to_excel(writer, sheet_name='Análisis_Almacenes', index=False)
-        
-        # NUEVO: Completar progreso y limpiar indicadores
-        status_text.text("✅ Informe generado exitosamente!")
-        progress_bar.progress(100)
-        
-        # Limpiar indicadores después de un momento
-        import time
-        time.sleep(1)
-        progress_bar.empty()
-        status_text.empty()
+            frame = pd.DataFrame.from_records(changed_albaranes, columns=[
+                'albaran', 'customer', 'previous_open', 'current_open',
+                'previous_total', 'current_total', 'changes'
+            ])
+            frame.insert(0, 'Fecha', comp['current_date'])
+            change_frames.append(frame)
         
-        return output.getvalue()
+        if change_frames:
+            changes_detail_df = pd.concat(change_frames, ignore_index=True).rename(columns={
+                'albaran': 'Albarán',
+                'customer': 'Cliente',
+                'previous_open': 'Open_Anterior',
+                'current_open': 'Open_Actual',
+                'previous_total': 'Total_Anterior',
+                'current_total': 'Total_Actual',
+                'changes': 'Cambios'
+            })
+            changes_detail_df['Cambios'] = changes_detail_df['Cambios'].str.join(' | ')
+            write_sheet_columns(writer, changes_detail_df, 'Detalles_Cambios')
+        
+        if _progress_state is not None:
+            _progress_state.update(percent=90, message="🏢 Procesando análisis por almacén...")
+        
+        # HOJA 5: Análisis por Almacén - un solo concat + groupby (Fecha, WH_Code)
+        warehouse_df = aggregate_by_date_and_warehouse(
+            excel_data, tuple(sorted(excel_data.keys())),
+            Tablillas_Pendientes=('Total_Open', 'sum'),
+            Total_Tablillas=('Total_Tablets', 'sum'),
+            Número_Albaranes=('Return_Packing_Slip', 'count')
+        )
+        
+        if not warehouse_df.empty:
+            warehouse_df = warehouse_df.rename(columns={'date': 'Fecha', 'WH_Code': 'Almacén'})
+            write_sheet_columns(writer, warehouse_df, 'Análisis_Almacenes')
+    
+    return output.getvalue()
+
+def submit_multi_day_report(analysis_results: Dict, excel_data: Dict[str, pd.DataFrame],
+                            retry_failed: bool = False) -> Future:
+    """Lanzar la generación del informe en el pool de fondo (una vez por conjunto de archivos)"""
+    report_key = tuple((date, hash_dataframe(df)) for date, df in excel_data.items())
+    future = st.session_state.get('multi_day_report_future')
+    failed = future is not None and future.done() and future.exception() is not None
+    
+    if st.session_state.get('multi_day_report_key') != report_key or (retry_failed and failed):
+        # El hilo de fondo solo anota el avance aquí; el hilo principal lo muestra
+        progress_state = {'percent': 0, 'message': "🔄 Generando informe ejecutivo..."}
+        
+        st.session_state['multi_day_report_key'] = report_key
+        st.session_state['multi_day_report_progress'] = progress_state
+        st.session_state['multi_day_report_future'] = _XLSX_POOL.submit(
+            build_multi_day_report_bytes, analysis_results, excel_data, _progress_state=progress_state
+        )
+    
+    return st.session_state['multi_day_report_future']
+
+def export_professional_multi_day_report(analysis_results: Dict, excel_data: Dict[str, pd.DataFrame]) -> Optional[bytes]:
+    """Exportar informe profesional multi-días - None mientras se genera o si falló"""
+    # El futuro de este rerun ya lo lanzó la pestaña: no se vuelven a hashear los DataFrames
+    future = st.session_state.get('multi_day_report_future') or submit_multi_day_report(analysis_results, excel_data)
+    
+    # NUEVO: Mostrar el avance sin bloquear; el botón de descarga aparece en un rerun posterior
+    if not future.done():
+        progress_state = st.session_state['multi_day_report_progress']
+        st.progress(progress_state['percent'], text=progress_state['message'])
+        return None
+    
+    try:
+        return future.result()
         
     except Exception as e:
-        # Limpiar indicadores en caso de error
-        progress_bar.empty()
-        status_text.empty()
         st.error(f"❌ Error generando Excel: {str(e)}")
-        return b''
+        return None
 
 def export_comprehensive_trends_report(analysis_results: Dict, excel_data: Dict[str, pd.DataFrame]):
     """Exportar análisis completo de tendencias - VERSIÓN CORREGIDA"""